@@ -30,6 +30,8 @@ class EmbeddingConfig:
 @dataclass
 class VectorDbConfig:
     host: str
+    unified_collections: bool
+    centroids: bool
 
 
 def _get_config_value(key: str, config_raw: dict, saved_config_raw: dict, default: Optional[str] = None) -> str:
@@ -148,7 +150,9 @@ class Config:
                 api_key=_get_config_value("GC_QA_RAG.EMBEDDING.API_KEY", config_raw, saved_config_raw)
             ),
             vector_db=VectorDbConfig(
-                host=_get_config_value("GC_QA_RAG.VECTOR_DB.HOST", config_raw, saved_config_raw, "http://host.docker.internal:6333")
+                host=_get_config_value("GC_QA_RAG.VECTOR_DB.HOST", config_raw, saved_config_raw, "http://host.docker.internal:6333"),
+                unified_collections=_get_config_value("GC_QA_RAG.VECTOR_DB.UNIFIED_COLLECTIONS", config_raw, saved_config_raw, "false").lower() == "true",
+                centroids=_get_config_value("GC_QA_RAG.VECTOR_DB.CENTROIDS", config_raw, saved_config_raw, "false").lower() == "true",
             ),
             root_path=_get_config_value("GC_QA_RAG.ROOT_PATH", config_raw, saved_config_raw, user_cache_dir("gc-qa-rag", ensure_exists=True)),
             log_path=_get_config_value("GC_QA_RAG.LOG_PATH", config_raw, saved_config_raw, user_log_dir("gc-qa-rag", ensure_exists=True)),
@@ -48,7 +48,13 @@ class EtlRagContext(BaseContext):
     """Context class for RAG (Retrieval Augmented Generation) operations."""
 
     def __init__(
-        self, root_path: str, doc_type: str, product: str, base_url: str, tag: str
+        self,
+        root_path: str,
+        doc_type: str,
+        product: str,
+        base_url: str,
+        tag: str,
+        unified: bool = False,
     ) -> None:
         """
         Initialize RAG context with additional RAG-specific attributes.
@@ -59,7 +65,9 @@ class EtlRagContext(BaseContext):
             product: Product name being processed
             base_url: Base URL for vector database
             tag: Tag for collection identification
+            unified: Whether all categories are written to one collection
         """
         super().__init__(root_path, doc_type, product)
         self.base_url = base_url
         self.tag = tag
+        self.unified = unified
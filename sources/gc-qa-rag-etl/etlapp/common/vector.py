@@ -1,10 +1,53 @@
 from typing import List, Dict, Any, Optional
+import uuid
+import numpy as np
 from qdrant_client import QdrantClient, models
 from qdrant_client.models import Distance, VectorParams, SparseVectorParams
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Collection holding one centroid vector per published collection, used by
+# the server to skip collections unlikely to answer a query
+CENTROID_COLLECTION = "collection_centroids"
+CENTROID_SAMPLE_SIZE = 2000  # Random points averaged per centroid
+CENTROID_SCROLL_BATCH = 1000
+
+# In unified mode all categories of a product share one collection, with the
+# category of every point in an indexed payload field
+UNIFIED_COLLECTION_PREFIX = "unified"
+CATEGORY_PAYLOAD_FIELD = "collection_category"
+# Category and file_index combined, so one query can group the hits of
+# several categories by document
+CATEGORY_DOCUMENT_PAYLOAD_FIELD = "category_file_index"
+
+
+def get_collection_name(category: str, product: str, tag: str, unified: bool) -> str:
+    """Get the tagged collection a category of a product is written to.
+
+    Args:
+        category (str): Collection category, e.g. "forum_qa"
+        product (str): Product name
+        tag (str): Tag of the publish run
+        unified (bool): Whether all categories share one collection
+
+    Returns:
+        str: Name of the collection
+    """
+    if unified:
+        return f"{UNIFIED_COLLECTION_PREFIX}_{product}_{tag}"
+    return f"{category}_{product}_{tag}"
+
+
+def _category_filter(category: str) -> models.Filter:
+    return models.Filter(
+        must=[
+            models.FieldCondition(
+                key=CATEGORY_PAYLOAD_FIELD, match=models.MatchValue(value=category)
+            )
+        ]
+    )
+
 
 class VectorConfig:
     """Configuration for vector collection parameters."""
@@ -36,11 +79,15 @@ class VectorClient:
         self.client = QdrantClient(url=url)
         self.vector_config = vector_config or VectorConfig()
 
-    def ensure_collection_exists(self, collection_name: str) -> None:
+    def ensure_collection_exists(
+        self, collection_name: str, category_index: bool = False
+    ) -> None:
         """Ensure a collection exists, create it if it doesn't.
 
         Args:
             collection_name (str): Name of the collection to check/create
+            category_index (bool): Whether to index the category payload field,
+                for collections holding several categories
 
         Raises:
             ValueError: If collection_name is empty
@@ -51,6 +98,8 @@ class VectorClient:
 
         if self.client.collection_exists(collection_name):
             logger.info(f"Collection {collection_name} already exists")
+            if category_index:
+                self.ensure_category_index(collection_name)
             return
 
         try:
@@ -80,14 +129,62 @@ class VectorClient:
             logger.error(f"Failed to create collection {collection_name}: {str(e)}")
             raise
 
+        if category_index:
+            self.ensure_category_index(collection_name)
+
+    def ensure_category_index(self, collection_name: str) -> None:
+        """Create the keyword indexes on the category payload fields.
+
+        Args:
+            collection_name (str): Name of the collection
+
+        Raises:
+            Exception: If index creation fails
+        """
+        for field_name in [CATEGORY_PAYLOAD_FIELD, CATEGORY_DOCUMENT_PAYLOAD_FIELD]:
+            try:
+                self.client.create_payload_index(
+                    collection_name=collection_name,
+                    field_name=field_name,
+                    field_schema=models.PayloadSchemaType.KEYWORD,
+                    wait=True,
+                )
+                logger.info(f"Indexed {field_name} of {collection_name}")
+            except Exception as e:
+                logger.error(
+                    f"Failed to index {field_name} of {collection_name}: {str(e)}"
+                )
+                raise
+
+    def count_category(self, collection_name: str, category: str) -> int:
+        """Count the points of a category in a unified collection.
+
+        Args:
+            collection_name (str): Name of the collection
+            category (str): Collection category
+
+        Returns:
+            int: Number of points with that category
+        """
+        return self.client.count(
+            collection_name=collection_name,
+            count_filter=_category_filter(category),
+            exact=True,
+        ).count
+
     def insert_to_collection(
-        self, collection_name: str, points: List[Dict[str, Any]]
+        self,
+        collection_name: str,
+        points: List[Dict[str, Any]],
+        category: Optional[str] = None,
     ) -> None:
         """Insert or update points in a collection.
 
         Args:
             collection_name (str): Name of the collection
             points (List[Dict[str, Any]]): List of points to insert/update
+            category (Optional[str]): Collection category stored in the payload
+                of every point, alone and combined with its file_index
 
         Raises:
             ValueError: If collection_name is empty or points list is empty
@@ -98,6 +195,13 @@ class VectorClient:
         if not points:
             raise ValueError("Points list cannot be empty")
 
+        if category:
+            for point in points:
+                point.payload[CATEGORY_PAYLOAD_FIELD] = category
+                point.payload[CATEGORY_DOCUMENT_PAYLOAD_FIELD] = (
+                    f"{category}/{point.payload['file_index']}"
+                )
+
         try:
             operation_info = self.client.upsert(
                 collection_name=collection_name,
@@ -210,3 +314,128 @@ class VectorClient:
         except Exception as e:
             logger.error(f"Failed to get collection aliases: {str(e)}")
             raise
+
+    def compute_centroid(
+        self,
+        collection_name: str,
+        vector_name: str = "question_dense",
+        category: Optional[str] = None,
+    ) -> Optional[List[float]]:
+        """Compute the normalized mean of a named dense vector over a collection.
+
+        The mean is taken over a random sample of at most CENTROID_SAMPLE_SIZE
+        points, so publishing large collections stays cheap.
+
+        Args:
+            collection_name (str): Name of the collection
+            vector_name (str): Name of the dense vector to average
+            category (Optional[str]): Only average the points of this category,
+                for unified collections
+
+        Returns:
+            Optional[List[float]]: Unit length centroid, or None if the
+                collection has no points
+        """
+        result = self.client.query_points(
+            collection_name=collection_name,
+            query=models.SampleQuery(sample=models.Sample.RANDOM),
+            query_filter=_category_filter(category) if category else None,
+            limit=CENTROID_SAMPLE_SIZE,
+            with_payload=False,
+            with_vectors=[vector_name],
+        )
+        if not result.points:
+            return None
+
+        vectors = np.array(
+            [point.vector[vector_name] for point in result.points], dtype=np.float64
+        )
+        total = vectors.sum(axis=0)
+        norm = np.linalg.norm(total)
+        if not norm:
+            return None
+        return (total / norm).tolist()
+
+    def upsert_centroid(
+        self,
+        alias_name: str,
+        collection_name: str,
+        centroid: List[float],
+        category: Optional[str] = None,
+    ) -> None:
+        """Store the centroid of a published collection.
+
+        Args:
+            alias_name (str): Alias the collection is published under
+            collection_name (str): Name of the tagged collection
+            centroid (List[float]): Centroid computed by compute_centroid
+            category (Optional[str]): Category the centroid was computed for,
+                for unified collections
+        """
+        payload = {"alias_name": alias_name, "collection_name": collection_name}
+        point_key = collection_name
+        if category:
+            payload[CATEGORY_PAYLOAD_FIELD] = category
+            point_key = f"{collection_name}/{category}"
+
+        if not self.client.collection_exists(CENTROID_COLLECTION):
+            self.client.create_collection(
+                collection_name=CENTROID_COLLECTION,
+                vectors_config=VectorParams(
+                    size=self.vector_config.dense_vector_size,
+                    distance=Distance.COSINE,
+                ),
+            )
+            logger.info(f"Created collection {CENTROID_COLLECTION}")
+
+        self.client.upsert(
+            collection_name=CENTROID_COLLECTION,
+            wait=True,
+            points=[
+                models.PointStruct(
+                    id=str(uuid.uuid5(uuid.NAMESPACE_URL, point_key)),
+                    vector=centroid,
+                    payload=payload,
+                )
+            ],
+        )
+        logger.info(f"Updated centroid of collection {collection_name}")
+
+    def delete_stale_centroids(self) -> int:
+        """Delete the centroids of collections no alias points to anymore.
+
+        Returns:
+            int: Number of deleted centroids
+        """
+        if not self.client.collection_exists(CENTROID_COLLECTION):
+            return 0
+
+        published = {
+            alias["collection_name"] for alias in self.get_collection_aliases()
+        }
+        stale_ids = []
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=CENTROID_COLLECTION,
+                limit=CENTROID_SCROLL_BATCH,
+                offset=offset,
+                with_payload=["collection_name"],
+                with_vectors=False,
+            )
+            stale_ids += [
+                point.id
+                for point in points
+                if point.payload.get("collection_name") not in published
+            ]
+            if offset is None:
+                break
+
+        if stale_ids:
+            self.client.delete(
+                collection_name=CENTROID_COLLECTION,
+                points_selector=models.PointIdsList(points=stale_ids),
+                wait=True,
+            )
+            logger.info(f"Deleted {len(stale_ids)} stale centroids")
+        return len(stale_ids)
@@ -7,7 +7,7 @@ from typing import List, Dict, Any, Optional
 from qdrant_client.models import PointStruct
 from etlapp.common.context import EtlRagContext
 from etlapp.common.format import extract_markdown_content
-from etlapp.common.vector import VectorClient
+from etlapp.common.vector import VectorClient, get_collection_name
 from etlapp.common.file import get_file_names_in_directory, read_text_from_file
 
 # Configure logging
@@ -185,10 +185,10 @@ def start_initialize_doc(context: EtlRagContext) -> None:
     root_path = context.root
     product = context.product
     url = context.base_url
-    collection_name = f"doc_{product}_{context.tag}"
+    collection_name = get_collection_name("doc", product, context.tag, context.unified)
 
     client = VectorClient(url)
-    client.ensure_collection_exists(collection_name)
+    client.ensure_collection_exists(collection_name, category_index=context.unified)
 
     folder_path = os.path.join(root_path, f"etl_doc/.temp/outputs_embedding/{product}")
     folder_path_full = os.path.join(
@@ -214,7 +214,7 @@ def start_initialize_doc(context: EtlRagContext) -> None:
             )
 
             if points:
-                client.insert_to_collection(collection_name, points)
+                client.insert_to_collection(collection_name, points, category="doc")
 
             if ignore_append_sub:
                 continue
@@ -235,4 +235,6 @@ def start_initialize_doc(context: EtlRagContext) -> None:
                 )
 
                 if sub_points:
-                    client.insert_to_collection(collection_name, sub_points)
+                    client.insert_to_collection(
+                        collection_name, sub_points, category="doc"
+                    )
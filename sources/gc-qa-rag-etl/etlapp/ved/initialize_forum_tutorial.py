@@ -7,7 +7,7 @@ from typing import List, Dict, Any, Optional
 from qdrant_client.models import PointStruct
 from etlapp.common.context import EtlRagContext
 from etlapp.common.hash import get_hash_folder
-from etlapp.common.vector import VectorClient
+from etlapp.common.vector import VectorClient, get_collection_name
 from etlapp.common.file import read_text_from_file
 
 # Configure logging
@@ -147,10 +147,12 @@ def start_initialize_forum_tutorial(context: EtlRagContext) -> None:
     root_path = context.root
     product = context.product
     url = context.base_url
-    collection_name = f"forum_tutorial_{product}_{context.tag}"
+    collection_name = get_collection_name(
+        "forum_tutorial", product, context.tag, context.unified
+    )
 
     client = VectorClient(url)
-    client.ensure_collection_exists(collection_name)
+    client.ensure_collection_exists(collection_name, category_index=context.unified)
 
     forum_file_path = f"{root_path}/das/.temp/forum/tutorial/{product}/combined.json"
     folder_path = f"{root_path}/etl_forum_tutorial/.temp/outputs_embedding/{product}"
@@ -194,4 +196,6 @@ def start_initialize_forum_tutorial(context: EtlRagContext) -> None:
             )
 
             if points:
-                client.insert_to_collection(collection_name, points)
+                client.insert_to_collection(
+                    collection_name, points, category="forum_tutorial"
+                )
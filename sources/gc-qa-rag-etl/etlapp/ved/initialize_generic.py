@@ -7,7 +7,7 @@ from typing import List, Dict, Any, Optional
 from qdrant_client.models import PointStruct
 from etlapp.common.context import EtlRagContext
 from etlapp.common.format import extract_markdown_content
-from etlapp.common.vector import VectorClient
+from etlapp.common.vector import VectorClient, get_collection_name
 from etlapp.common.file import get_file_names_in_directory, read_text_from_file
 
 logger = logging.getLogger(__name__)
@@ -164,9 +164,11 @@ def start_initialize_generic(context: EtlRagContext) -> None:
     root_path = context.root
     url = context.base_url
     product = context.product
-    collection_name = f"generic_{product}_{context.tag}"
+    collection_name = get_collection_name(
+        "generic", product, context.tag, context.unified
+    )
     client = VectorClient(url)
-    client.ensure_collection_exists(collection_name)
+    client.ensure_collection_exists(collection_name, category_index=context.unified)
     folder_path = os.path.join(
         root_path, f"etl_generic/.temp/outputs_embedding/{product}"
     )
@@ -188,4 +190,4 @@ def start_initialize_generic(context: EtlRagContext) -> None:
                 folder_path_full=folder_path_full,
             )
             if points:
-                client.insert_to_collection(collection_name, points)
+                client.insert_to_collection(collection_name, points, category="generic")
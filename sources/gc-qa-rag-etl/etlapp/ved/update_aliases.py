@@ -1,6 +1,6 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import logging
-from etlapp.common.vector import VectorClient
+from etlapp.common.vector import UNIFIED_COLLECTION_PREFIX, VectorClient
 
 logger = logging.getLogger(__name__)
 
@@ -24,9 +24,34 @@ COLLECTION_ALIASES = {
     ],
 }
 
+# Categories published as {category}_{product}_prod aliases
+COLLECTION_CATEGORIES = ["doc", "forum_qa", "forum_tutorial", "generic"]
+
+
+def get_unified_category(collection_name: str, alias_name: str) -> Optional[str]:
+    """
+    Get the category an alias publishes from a unified collection.
+
+    Args:
+        collection_name: Name of the tagged collection
+        alias_name: Name of the {category}_{product}_prod alias
+
+    Returns:
+        The category, or None if the collection is not a unified one
+    """
+    if not collection_name.startswith(f"{UNIFIED_COLLECTION_PREFIX}_"):
+        return None
+    for category in COLLECTION_CATEGORIES:
+        if alias_name.startswith(f"{category}_"):
+            return category
+    return None
+
 
 def update_alias_pairs(
-    client: VectorClient, alias_pairs: List[Tuple[str, str]], tag: str = None
+    client: VectorClient,
+    alias_pairs: List[Tuple[str, str]],
+    tag: str = None,
+    centroids: bool = False,
 ) -> None:
     """
     Update a list of collection aliases.
@@ -35,11 +60,15 @@ def update_alias_pairs(
         client: VectorClient instance
         alias_pairs: List of (source_collection, target_alias) tuples
         tag: Optional tag to replace in collection names
+        centroids: Whether to store the centroid of every collection
     """
     for source, target in alias_pairs:
         try:
             # Replace {tag} placeholder if present
             source_collection = source.format(tag=tag) if tag else source
+            if centroids:
+                category = get_unified_category(source_collection, target)
+                update_collection_centroid(client, source_collection, target, category)
             client.update_collection_aliases(source_collection, target)
             logger.info(f"Successfully updated alias: {source_collection} -> {target}")
         except Exception as e:
@@ -48,29 +77,82 @@ def update_alias_pairs(
             )
 
 
-def start_update_aliases(url: str, tag: str) -> None:
+def update_collection_centroid(
+    client: VectorClient,
+    collection_name: str,
+    alias_name: str,
+    category: Optional[str] = None,
+) -> None:
+    """
+    Store the centroid of a collection before it is published.
+
+    Failures are logged only: the server searches collections without a
+    centroid unconditionally.
+
+    Args:
+        client: VectorClient instance
+        collection_name: Name of the tagged collection
+        alias_name: Alias the collection is about to be published under
+        category: Category published by the alias, for unified collections
+    """
+    try:
+        centroid = client.compute_centroid(collection_name, category=category)
+        if centroid is None:
+            logger.warning(f"Collection {collection_name} is empty, no centroid")
+            return
+        client.upsert_centroid(alias_name, collection_name, centroid, category)
+    except Exception as e:
+        logger.error(f"Failed to update centroid of {collection_name}: {str(e)}")
+
+
+def delete_stale_centroids(client: VectorClient) -> None:
+    """
+    Delete the centroids of collections that are no longer published.
+
+    Args:
+        client: VectorClient instance
+    """
+    try:
+        client.delete_stale_centroids()
+    except Exception as e:
+        logger.error(f"Failed to delete stale centroids: {str(e)}")
+
+
+def start_update_aliases(
+    url: str, tag: str, unified: bool = False, centroids: bool = False
+) -> None:
     """
     Start the process of updating collection aliases.
 
     Args:
         url: URL of the vector database
         tag: Tag identifier for the update process
+        unified: Whether the collections were published in unified mode
+        centroids: Whether to store the centroid of every published collection
     """
     logger.info(f"Starting alias updates with tag: {tag}")
     client = VectorClient(url)
 
+    if unified:
+        update_unified_aliases(client, tag, centroids=centroids)
+        delete_stale_centroids(client)
+        return
+
     try:
         # Update doc collection aliases
-        update_alias_pairs(client, COLLECTION_ALIASES["doc"], tag)
+        update_alias_pairs(client, COLLECTION_ALIASES["doc"], tag, centroids)
 
         # Update forum QA collection aliases
-        update_alias_pairs(client, COLLECTION_ALIASES["forum_qa"], tag)
+        update_alias_pairs(client, COLLECTION_ALIASES["forum_qa"], tag, centroids)
 
         # Update forum tutorial collection aliases
-        update_alias_pairs(client, COLLECTION_ALIASES["forum_tutorial"], tag)
+        update_alias_pairs(client, COLLECTION_ALIASES["forum_tutorial"], tag, centroids)
 
         # Update generic collection aliases for all existing generic collections
-        update_generic_aliases(client, tag)
+        update_generic_aliases(client, tag, centroids)
+
+        # Remove the centroids of the collections the aliases pointed to before
+        delete_stale_centroids(client)
 
         logger.info("All alias updates completed successfully")
     except Exception as e:
@@ -78,13 +160,16 @@ def start_update_aliases(url: str, tag: str) -> None:
         raise
 
 
-def update_generic_aliases(client: VectorClient, tag: str) -> None:
+def update_generic_aliases(
+    client: VectorClient, tag: str, centroids: bool = False
+) -> None:
     """
     Update aliases for all generic collections that match the pattern.
 
     Args:
         client: VectorClient instance
         tag: Tag identifier for the update process
+        centroids: Whether to store the centroid of every collection
     """
     try:
         # Get all collections from the vector database
@@ -107,7 +192,8 @@ def update_generic_aliases(client: VectorClient, tag: str) -> None:
                     generic_collections.append((source, target))
 
         if generic_collections:
-            update_alias_pairs(client, generic_collections, None)  # Don't format again
+            # Don't format again
+            update_alias_pairs(client, generic_collections, None, centroids)
             logger.info(
                 f"Updated {len(generic_collections)} generic collection aliases"
             )
@@ -120,7 +206,54 @@ def update_generic_aliases(client: VectorClient, tag: str) -> None:
         pass
 
 
-def start_update_aliases_by_product(url: str, product: str, tag: str) -> None:
+def update_unified_aliases(
+    client: VectorClient,
+    tag: str,
+    product: Optional[str] = None,
+    centroids: bool = False,
+) -> None:
+    """
+    Publish the categories found in the unified collections of a tag.
+
+    Every category with points in unified_{product}_{tag} gets its
+    {category}_{product}_prod alias pointed at that collection, so the server
+    can search all of them with one query.
+
+    Args:
+        client: VectorClient instance
+        tag: Tag identifier for the update process
+        product: Only publish the collection of this product
+        centroids: Whether to store the centroid of every category
+    """
+    prefix = f"{UNIFIED_COLLECTION_PREFIX}_"
+    suffix = f"_{tag}"
+    alias_pairs = []
+
+    for collection in client.client.get_collections().collections:
+        collection_name = collection.name
+        if not (
+            collection_name.startswith(prefix) and collection_name.endswith(suffix)
+        ):
+            continue
+        collection_product = collection_name[len(prefix) : -len(suffix)]
+        if not collection_product or (product and collection_product != product):
+            continue
+        for category in COLLECTION_CATEGORIES:
+            if client.count_category(collection_name, category):
+                alias_pairs.append(
+                    (collection_name, f"{category}_{collection_product}_prod")
+                )
+
+    if alias_pairs:
+        update_alias_pairs(client, alias_pairs, None, centroids)  # Don't format again
+        logger.info(f"Updated {len(alias_pairs)} unified collection aliases")
+    else:
+        logger.warning(f"No unified collections found for tag: {tag}")
+
+
+def start_update_aliases_by_product(
+    url: str, product: str, tag: str, unified: bool = False, centroids: bool = False
+) -> None:
     """
     Start the process of updating collection aliases for a specific product.
 
@@ -128,10 +261,17 @@ def start_update_aliases_by_product(url: str, product: str, tag: str) -> None:
         url: URL of the vector database
         product: Product name (forguncy, wyn, spreadjs, gcexcel, spreadjsgcexcel)
         tag: Tag identifier for the update process
+        unified: Whether the collections were published in unified mode
+        centroids: Whether to store the centroid of every published collection
     """
     logger.info(f"Starting alias updates for product: {product} with tag: {tag}")
     client = VectorClient(url)
 
+    if unified:
+        update_unified_aliases(client, tag, product, centroids)
+        delete_stale_centroids(client)
+        return
+
     try:
         # Filter aliases for the specific product
         product_aliases = []
@@ -157,7 +297,8 @@ def start_update_aliases_by_product(url: str, product: str, tag: str) -> None:
         product_aliases.append((generic_source, generic_target))
 
         if product_aliases:
-            update_alias_pairs(client, product_aliases, tag)
+            update_alias_pairs(client, product_aliases, tag, centroids)
+            delete_stale_centroids(client)
             logger.info(f"Alias updates completed successfully for product: {product}")
         else:
             logger.warning(f"No alias configurations found for product: {product}")
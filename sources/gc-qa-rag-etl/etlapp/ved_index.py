@@ -44,7 +44,9 @@ def ved_index_start(doc_type: DocType, product: ProductType, tag: str) -> None:
     base_url = app_config.vector_db.host
     root_path = app_config.root_path
 
-    context = EtlRagContext(root_path, doc_type, product, base_url, tag)
+    unified = app_config.vector_db.unified_collections
+
+    context = EtlRagContext(root_path, doc_type, product, base_url, tag, unified)
 
     if doc_type == "doc":
         start_initialize_doc(context)
@@ -67,7 +69,9 @@ def ved_update_collections_aliases(tag: str) -> None:
         None
     """
     base_url = app_config.vector_db.host
-    start_update_aliases(base_url, tag)
+    unified = app_config.vector_db.unified_collections
+    centroids = app_config.vector_db.centroids
+    start_update_aliases(base_url, tag, unified, centroids)
 
 
 def ved_update_collections_aliases_by_product(product: ProductType, tag: str) -> None:
@@ -82,7 +86,9 @@ def ved_update_collections_aliases_by_product(product: ProductType, tag: str) ->
         None
     """
     base_url = app_config.vector_db.host
-    start_update_aliases_by_product(base_url, product, tag)
+    unified = app_config.vector_db.unified_collections
+    centroids = app_config.vector_db.centroids
+    start_update_aliases_by_product(base_url, product, tag, unified, centroids)
 
 
 def main():
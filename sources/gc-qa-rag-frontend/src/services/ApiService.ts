@@ -30,7 +30,13 @@ export const getSearchResult = async (
       "Content-Type": "application/json",
     },
     body: JSON.stringify(requestBody),
-  }).then((res) => res.json());
+  }).then(async (res) => {
+    const results = await res.json();
+    return {
+      results: results,
+      retrievalId: res.headers.get("X-Retrieval-Id") || "",
+    };
+  });
 };
 
 export const getChatResult = async (
@@ -39,7 +45,10 @@ export const getChatResult = async (
   product: string,
   callback: (chunk: string, end: boolean) => void,
   onController: (controller: AbortController) => void,
-  extraInstruction: string = ""
+  extraInstruction: string = "",
+  retrievalId: string = "",
+  sessionId: string = "",
+  onSession?: (sessionId: string) => void
 ) => {
   const url = `${URL_ROOT}/chat_streaming/`;
 
@@ -48,6 +57,9 @@ export const getChatResult = async (
     messages: messages,
     product: product,
     extra_instruction: extraInstruction,
+    retrieval_id: retrievalId,
+    session_id: sessionId,
+    stream_events: true,
   });
 
   const controller = new AbortController();
@@ -65,6 +77,11 @@ export const getChatResult = async (
       openWhenHidden:true,
       async onopen(response) {
         if (response.ok) {
+          // the server issues the id that continues the session
+          const issuedSessionId = response.headers.get("X-Session-Id");
+          if (issuedSessionId) {
+            onSession?.(issuedSessionId);
+          }
           return;
         } else if (response.status >= 400 && response.status < 500 && response.status !== 429) {
           throw new FatalError();
@@ -78,6 +95,10 @@ export const getChatResult = async (
         if (msg.event === 'FatalError') {
           throw new FatalError(msg.data);
         }
+        // typed events (sources, timing, heartbeat) carry no answer text
+        if (msg.event && msg.event !== 'message') {
+          return;
+        }
         callback?.(JSON.parse(msg.data)["text"], false);
       },
       onclose() {
@@ -108,7 +129,10 @@ export const getThinkResult = async (
   product: string,
   callback: (chunk: string, end: boolean) => void,
   onController: (controller: AbortController) => void,
-  extraInstruction: string = ""
+  extraInstruction: string = "",
+  retrievalId: string = "",
+  sessionId: string = "",
+  onSession?: (sessionId: string) => void
 ) => {
   const url = `${URL_ROOT}/think_streaming/`;
 
@@ -117,6 +141,9 @@ export const getThinkResult = async (
     messages: messages,
     product: product,
     extra_instruction: extraInstruction,
+    retrieval_id: retrievalId,
+    session_id: sessionId,
+    stream_events: true,
   });
 
   const controller = new AbortController();
@@ -134,6 +161,11 @@ export const getThinkResult = async (
       openWhenHidden: true,
       async onopen(response) {
         if (response.ok) {
+          // the server issues the id that continues the session
+          const issuedSessionId = response.headers.get("X-Session-Id");
+          if (issuedSessionId) {
+            onSession?.(issuedSessionId);
+          }
           return;
         } else if (response.status >= 400 && response.status < 500 && response.status !== 429) {
           throw new FatalError();
@@ -147,6 +179,10 @@ export const getThinkResult = async (
         if (msg.event === 'FatalError') {
           throw new FatalError(msg.data);
         }
+        // typed events (sources, timing, heartbeat) carry no answer text
+        if (msg.event && msg.event !== 'message') {
+          return;
+        }
         callback?.(JSON.parse(msg.data)["text"], false);
       },
       onclose() {
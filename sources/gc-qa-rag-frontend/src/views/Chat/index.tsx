@@ -60,7 +60,7 @@ const ChatPage = () => {
             getSearchResult(query, "chat", productRef.current, "", 0).then(
                 (res) => {
                     setSearchLoading(false);
-                    setSearchList(res);
+                    setSearchList(res.results);
                 }
             );
         }
@@ -21,6 +21,8 @@ export const useSearchState = () => {
   const [controller, setController] = useState<AbortController>();
   const shouldSearchOnModeChange = useRef(false);
   const retrivalsUUID = useRef(uuidv4());
+  // Issued by the server once the first answer of a conversation starts
+  const sessionId = useRef("");
   const appendMessageMap = useRef(new Map());
 
   return {
@@ -34,6 +36,7 @@ export const useSearchState = () => {
     setController,
     shouldSearchOnModeChange,
     retrivalsUUID,
+    sessionId,
     appendMessageMap,
   };
 }; 
\ No newline at end of file
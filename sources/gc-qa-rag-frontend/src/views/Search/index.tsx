@@ -107,6 +107,7 @@ const SearchPage = () => {
         setController,
         shouldSearchOnModeChange,
         retrivalsUUID,
+        sessionId,
         appendMessageMap,
     } = useSearchState();
 
@@ -142,6 +143,7 @@ const SearchPage = () => {
             item.search.loading = false;
             item.search.results = [];
             refreshUI();
+            return "";
         } else {
             item.search.loading = true;
             const res = await getSearchResult(
@@ -152,12 +154,13 @@ const SearchPage = () => {
                 retrivals.length - 1
             );
             item.search.loading = false;
-            item.search.results = res;
+            item.search.results = res.results;
             refreshUI();
+            return res.retrievalId;
         }
     };
 
-    const createNewChatMessage = (newQuery: string) => {
+    const createNewChatMessage = async (newQuery: string) => {
         if (searchMode !== SearchMode.Chat) return;
 
         const newItem = createNewRetrivalItem(newQuery);
@@ -165,7 +168,7 @@ const SearchPage = () => {
         refreshUI();
 
         appendMessageMap.current.set(retrivals.length - 1, "");
-        loadSearchResult(newItem);
+        const retrievalPromise = loadSearchResult(newItem);
 
         let currentIndex = 0;
         const typeWrite = (text: string) => {
@@ -186,6 +189,9 @@ const SearchPage = () => {
 
             const messages = convertToMessages(retrivals);
             const extraInstruction = buildExtraInstruction(answerOptions);
+            // The first turn searches the same keyword, so reuse that retrieval
+            const retrievalId =
+                messages.length === 1 ? await retrievalPromise : "";
 
             getChatResult(
                 newQuery,
@@ -210,12 +216,17 @@ const SearchPage = () => {
                 (controller) => {
                     setController(controller);
                 },
-                extraInstruction
+                extraInstruction,
+                retrievalId,
+                sessionId.current || "new",
+                (issuedSessionId) => {
+                    sessionId.current = issuedSessionId;
+                }
             );
         }
     };
 
-    const createNewThinkMessage = (newQuery: string) => {
+    const createNewThinkMessage = async (newQuery: string) => {
         if (searchMode !== SearchMode.Think) return;
 
         const newItem = createNewRetrivalItem(newQuery);
@@ -223,7 +234,7 @@ const SearchPage = () => {
         refreshUI();
 
         appendMessageMap.current.set(retrivals.length - 1, "");
-        loadSearchResult(newItem);
+        const retrievalPromise = loadSearchResult(newItem);
 
         let currenReasoningContenttIndex = 0;
         const typeWriteReasoningContent = (text: string) => {
@@ -256,6 +267,9 @@ const SearchPage = () => {
 
             const messages = convertToMessages(retrivals);
             const extraInstruction = buildExtraInstruction(answerOptions);
+            // The first turn searches the same keyword, so reuse that retrieval
+            const retrievalId =
+                messages.length === 1 ? await retrievalPromise : "";
 
             getThinkResult(
                 newQuery,
@@ -297,7 +311,12 @@ const SearchPage = () => {
                 (controller) => {
                     setController(controller);
                 },
-                extraInstruction
+                extraInstruction,
+                retrievalId,
+                sessionId.current || "new",
+                (issuedSessionId) => {
+                    sessionId.current = issuedSessionId;
+                }
             );
         }
     };
@@ -402,6 +421,7 @@ const SearchPage = () => {
 
         controller?.abort();
         retrivalsUUID.current = uuidv4();
+        sessionId.current = "";
         retrivals.splice(0, retrivals.length);
         setRetrivals([]);
         appendMessageMap.current.clear();
@@ -421,6 +441,7 @@ const SearchPage = () => {
 
         controller?.abort();
         retrivalsUUID.current = uuidv4();
+        sessionId.current = "";
         retrivals.splice(0, retrivals.length);
         setRetrivals([]);
         appendMessageMap.current.clear();
@@ -0,0 +1,196 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict
+from fastapi import HTTPException
+from ragapp.common.metrics import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AdmissionConfig:
+    max_concurrency: int  # Requests generating at the same time
+    max_queue: int  # Requests waiting for a slot
+    max_queue_per_client: int  # Requests of one client waiting for a slot
+    max_wait: float  # Seconds a request waits before it is rejected
+
+
+# Admission configurations
+ADMISSION_LIMITS: Dict[str, AdmissionConfig] = {
+    "chat": AdmissionConfig(
+        max_concurrency=64, max_queue=256, max_queue_per_client=4, max_wait=30
+    ),
+    "think": AdmissionConfig(
+        max_concurrency=16, max_queue=64, max_queue_per_client=2, max_wait=30
+    ),
+    "research": AdmissionConfig(
+        max_concurrency=8, max_queue=32, max_queue_per_client=1, max_wait=60
+    ),
+}
+
+
+class AdmissionTicket:
+    """A granted slot, released once the response is done with it."""
+
+    def __init__(self, controller: "AdmissionController", mode: str):
+        self._controller = controller
+        self._mode = mode
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self._mode)
+
+
+class _ModeState:
+    def __init__(self, config: AdmissionConfig):
+        self.config = config
+        self.active = 0
+        # Waiting requests per client, served round-robin between clients
+        self.queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.waited = 0
+        self.wait_ms_total = 0
+        self.max_wait_ms = 0
+
+    def enqueue(self, client: str) -> asyncio.Future:
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(client, deque()).append(waiter)
+        self.queued += 1
+        return waiter
+
+    def remove(self, client: str, waiter: asyncio.Future) -> None:
+        queue = self.queues.get(client)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.queued -= 1
+            if not queue:
+                del self.queues[client]
+
+    def hand_over(self) -> bool:
+        """Pass a released slot to the next client in turn, if any waits."""
+        while self.queues:
+            client, queue = next(iter(self.queues.items()))
+            waiter = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self.queues.move_to_end(client)
+            else:
+                del self.queues[client]
+            if not waiter.done():
+                waiter.set_result(None)
+                return True
+        return False
+
+
+class AdmissionController:
+    """Bounds the concurrent LLM generations per mode.
+
+    Requests beyond the concurrency budget wait in a bounded queue. Freed
+    slots are handed to waiting clients in turn, so a client sending a burst
+    only delays its own requests. Requests are rejected with 503 when the
+    queue is full or they waited too long, and with 429 when their client
+    already has too many requests waiting.
+
+    Fairness holds only as long as clients cannot choose their key, so
+    requests are queued under the trusted address from get_client_key.
+    """
+
+    def __init__(self):
+        self._states = {
+            mode: _ModeState(config) for mode, config in ADMISSION_LIMITS.items()
+        }
+
+    def _reject(self, state: _ModeState, status_code: int, detail: str):
+        state.rejected += 1
+        retry_after = max(1, round(state.config.max_wait / 2))
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    async def acquire(self, mode: str, client: str) -> AdmissionTicket:
+        """Wait for a generation slot of a mode.
+
+        Args:
+            mode: Admission mode, e.g. "chat"
+            client: Trusted client address from limiter.get_client_key
+
+        Returns:
+            AdmissionTicket: The slot, to be released when the stream ends
+
+        Raises:
+            HTTPException: 429 or 503 if the request is not admitted
+        """
+        state = self._states[mode]
+        if state.active < state.config.max_concurrency and not state.queued:
+            state.active += 1
+            state.admitted += 1
+            return AdmissionTicket(self, mode)
+
+        if state.queued >= state.config.max_queue:
+            raise self._reject(state, 503, "Server Busy")
+        if len(state.queues.get(client, ())) >= state.config.max_queue_per_client:
+            raise self._reject(state, 429, "Too Many Requests")
+
+        started = time.monotonic()
+        waiter = state.enqueue(client)
+        try:
+            await asyncio.wait_for(waiter, state.config.max_wait)
+        except asyncio.TimeoutError:
+            state.remove(client, waiter)
+            state.timeouts += 1
+            logger.warning(f"Admission of {mode} request timed out")
+            raise self._reject(state, 503, "Server Busy")
+        except BaseException:
+            state.remove(client, waiter)
+            # The slot may have been handed over just before the cancellation
+            if waiter.done() and not waiter.cancelled():
+                self._release(mode)
+            raise
+
+        wait_ms = round((time.monotonic() - started) * 1000)
+        state.admitted += 1
+        state.waited += 1
+        state.wait_ms_total += wait_ms
+        state.max_wait_ms = max(state.max_wait_ms, wait_ms)
+        return AdmissionTicket(self, mode)
+
+    def _release(self, mode: str) -> None:
+        state = self._states[mode]
+        if not state.hand_over():
+            state.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            mode: {
+                "active": state.active,
+                "max_concurrency": state.config.max_concurrency,
+                "queued": state.queued,
+                "queued_clients": len(state.queues),
+                "max_queue": state.config.max_queue,
+                "admitted": state.admitted,
+                "rejected": state.rejected,
+                "timeouts": state.timeouts,
+                "waited": state.waited,
+                "avg_wait_ms": (
+                    round(state.wait_ms_total / state.waited) if state.waited else 0
+                ),
+                "max_wait_ms": state.max_wait_ms,
+            }
+            for mode, state in self._states.items()
+        }
+
+
+# Create a singleton instance
+admission = AdmissionController()
+metrics.register("admission", admission.stats)
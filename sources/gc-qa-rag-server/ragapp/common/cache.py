@@ -0,0 +1,331 @@
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
+from qdrant_client import models
+from ragapp.common.config import app_config
+from ragapp.common.metrics import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Prefix of every key written to the shared backend
+SHARED_KEY_PREFIX = "gc_qa_rag"
+
+# Key of the JSON object a search hit is stored as in the shared backend
+_SCORED_POINT_KEY = "__scored_point__"
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize free text before using it as part of a cache key.
+
+    Args:
+        text: Raw text such as a user query
+
+    Returns:
+        str: NFKC-normalized text with collapsed whitespace
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    return _WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Build a fixed-length cache key from arbitrary parts.
+
+    Args:
+        parts: JSON-serializable key components
+
+    Returns:
+        str: Hex digest identifying the parts
+    """
+    raw = json.dumps(parts, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, models.ScoredPoint):
+        return {_SCORED_POINT_KEY: value.model_dump(mode="json")}
+    raise TypeError(f"Cannot store {type(value).__name__} in the shared cache")
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_decode_value(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if _SCORED_POINT_KEY in value:
+        data = value[_SCORED_POINT_KEY]
+        # Hits are cached with id and version cleared, which fail validation
+        point = models.ScoredPoint.model_validate({**data, "id": 0, "version": 0})
+        point.id = data["id"]
+        point.version = data["version"]
+        return point
+    return {key: _decode_value(item) for key, item in value.items()}
+
+
+def serialize_value(value: Any) -> bytes:
+    """Serialize a cached value to JSON for the shared backend.
+
+    Args:
+        value: JSON-compatible data, possibly containing Qdrant ScoredPoints
+
+    Returns:
+        bytes: UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_encode_value)
+    return json.dumps(value, ensure_ascii=False, default=_encode_value).encode("utf-8")
+
+
+def deserialize_value(raw: bytes) -> Any:
+    """Inverse of serialize_value."""
+    data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    return _decode_value(data)
+
+
+class LRUCache:
+    """Thread-safe in-process cache with LRU and TTL eviction."""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        """Initialize the cache.
+
+        Args:
+            name: Name reported in stats
+            maxsize: Maximum number of entries kept
+            ttl: Default time to live of an entry in seconds
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a value, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value, evicting the least recently used entries if full."""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    async def aget(self, key: str) -> Optional[Any]:
+        return self.get(key)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.set(key, value, ttl)
+
+    async def adelete(self, key: str) -> None:
+        self.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._data)
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class RedisCache:
+    """Cache shared between workers through a Redis-protocol server.
+
+    Entries are also kept in a small local LRU so that repeated lookups in
+    the same worker skip the network round trip. Backend errors are logged
+    and treated as misses, so an unavailable store only costs cache hits.
+    """
+
+    def __init__(self, name: str, url: str, ttl: float, local: LRUCache):
+        """Initialize the cache.
+
+        Args:
+            name: Namespace of the keys in the shared store
+            url: Redis connection URL
+            ttl: Default time to live of an entry in seconds
+            local: In-process cache consulted before the shared store
+        """
+        import redis
+        import redis.asyncio
+
+        self.name = name
+        self.ttl = ttl
+        self.local = local
+        self.prefix = f"{SHARED_KEY_PREFIX}:{name}:"
+        self._client = redis.Redis.from_url(url)
+        self._async_client = redis.asyncio.Redis.from_url(url)
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _shared_key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _expire_seconds(self, ttl: Optional[float]) -> int:
+        return max(1, int(self.ttl if ttl is None else ttl))
+
+    def _on_error(self, operation: str, e: Exception) -> None:
+        self.errors += 1
+        logger.warning(f"Shared cache {self.name} {operation} failed: {e}")
+
+    def _on_remote_value(self, key: str, raw: Optional[bytes]) -> Optional[Any]:
+        if raw is None:
+            self.misses += 1
+            return None
+        value = deserialize_value(raw)
+        self.hits += 1
+        self.local.set(key, value)
+        return value
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        try:
+            return self._on_remote_value(key, self._client.get(self._shared_key(key)))
+        except Exception as e:
+            self._on_error("get", e)
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.local.set(key, value, ttl)
+        try:
+            self._client.set(
+                self._shared_key(key),
+                serialize_value(value),
+                ex=self._expire_seconds(ttl),
+            )
+        except Exception as e:
+            self._on_error("set", e)
+
+    def delete(self, key: str) -> None:
+        self.local.delete(key)
+        try:
+            self._client.delete(self._shared_key(key))
+        except Exception as e:
+            self._on_error("delete", e)
+
+    def clear(self) -> None:
+        self.local.clear()
+
+    async def aget(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        try:
+            raw = await self._async_client.get(self._shared_key(key))
+            return self._on_remote_value(key, raw)
+        except Exception as e:
+            self._on_error("get", e)
+            return None
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.local.set(key, value, ttl)
+        try:
+            await self._async_client.set(
+                self._shared_key(key),
+                serialize_value(value),
+                ex=self._expire_seconds(ttl),
+            )
+        except Exception as e:
+            self._on_error("set", e)
+
+    async def adelete(self, key: str) -> None:
+        self.local.delete(key)
+        try:
+            await self._async_client.delete(self._shared_key(key))
+        except Exception as e:
+            self._on_error("delete", e)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "errors": self.errors,
+            "local": self.local.stats(),
+        }
+
+
+Cache = Union[LRUCache, RedisCache]
+
+
+def create_cache(name: str, maxsize: int, ttl: float, shared: bool = True) -> Cache:
+    """Create a cache and register its stats with the metrics registry.
+
+    Args:
+        name: Name of the cache, used as the shared key namespace
+        maxsize: Maximum number of entries kept in process
+        ttl: Default time to live of an entry in seconds
+        shared: Whether the cache may use the configured shared backend
+
+    Returns:
+        Cache: A RedisCache if a shared backend is configured, else an LRUCache
+    """
+    cache: Cache = LRUCache(name, maxsize, ttl)
+
+    redis_url = app_config.cache.redis_url
+    if shared and redis_url:
+        try:
+            cache = RedisCache(name, redis_url, ttl, local=cache)
+        except ImportError:
+            logger.warning(
+                f"Package redis is not installed, cache {name} stays in-process"
+            )
+
+    metrics.register(f"cache.{name}", cache.stats)
+    return cache
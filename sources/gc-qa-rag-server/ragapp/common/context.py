@@ -0,0 +1,192 @@
+import re
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Set
+from ragapp.common.cache import normalize_text
+from ragapp.common.config import app_config
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Hits whose question and answer shingles overlap at least this much are
+# treated as the same knowledge and only the higher ranked one is kept
+NEAR_DUPLICATE_THRESHOLD = 0.85
+
+# Encoding used when the optional tiktoken package is available
+TIKTOKEN_ENCODING = "cl100k_base"
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def _load_token_counter() -> Callable[[str], int]:
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception as e:
+        logger.info(f"tiktoken unavailable ({e}), estimating token counts")
+        return estimate_tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a text without a tokenizer.
+
+    CJK characters are counted as one token each and the remaining
+    characters as one token per four, which slightly overestimates typical
+    BPE tokenizers and keeps prompts on the safe side of the budget.
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        int: Estimated number of tokens
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+_count_tokens: Optional[Callable[[str], int]] = None
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text with tiktoken, or estimate them."""
+    global _count_tokens
+    if _count_tokens is None:
+        _count_tokens = _load_token_counter()
+    return _count_tokens(text)
+
+
+def project_hit(hit) -> Dict[str, Any]:
+    """Keep only the fields of a search hit that the prompts use.
+
+    Args:
+        hit: A scored point returned by the search
+
+    Returns:
+        Dict[str, Any]: Title, url, category, question and answer of the hit
+    """
+    payload = hit.payload or {}
+    entry = {
+        "title": payload.get("title", ""),
+        "url": payload.get("url", ""),
+        "category": payload.get("collection_category", payload.get("category", "")),
+        "question": payload.get("question", ""),
+        "answer": payload.get("answer", ""),
+    }
+    return {key: value for key, value in entry.items() if value}
+
+
+def build_sources(hits: List) -> List[Dict[str, Any]]:
+    """Get the citations of search hits, one per document.
+
+    Args:
+        hits: Search hits in descending relevance
+
+    Returns:
+        List[Dict[str, Any]]: Title, url, category and question of the best
+            hit of every document
+    """
+    sources = []
+    seen_urls = set()
+    for hit in hits:
+        entry = project_hit(hit)
+        url = entry.get("url")
+        if url and url in seen_urls:
+            continue
+        seen_urls.add(url)
+        entry.pop("answer", None)
+        sources.append(entry)
+    return sources
+
+
+def _shingles(entry: Dict[str, Any]) -> Set[str]:
+    text = normalize_text(
+        entry.get("question", "") + " " + entry.get("answer", "")
+    ).casefold()
+    if len(text) < 2:
+        return {text}
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+def _is_near_duplicate(shingles: Set[str], seen: List[Set[str]]) -> bool:
+    for other in seen:
+        union = len(shingles | other)
+        if union and len(shingles & other) / union >= NEAR_DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+
+def _render(entry: Dict[str, Any]) -> str:
+    return json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+
+
+def build_hits_context(
+    hits: List,
+    token_budget: Optional[int] = None,
+    include_full_answer: bool = True,
+) -> str:
+    """Render search hits as compact prompt context within a token budget.
+
+    Hits are taken in rank order, projected to the fields the prompts need
+    and dropped if they repeat a higher ranked hit. Entries are added until
+    the budget is spent; the remaining budget is then used to attach the
+    full document of the highest ranked hits, once per document.
+
+    Args:
+        hits: Search hits in descending relevance
+        token_budget: Maximum number of context tokens, defaults to the
+            configured context token budget
+        include_full_answer: Whether full documents may be attached
+
+    Returns:
+        str: A JSON array with one hit per line
+    """
+    if token_budget is None:
+        token_budget = app_config.context_token_budget
+
+    entries: List[Dict[str, Any]] = []
+    full_answers: List[str] = []
+    seen: List[Set[str]] = []
+    used = 2  # Enclosing brackets
+    duplicates = 0
+
+    for hit in hits:
+        entry = project_hit(hit)
+        shingles = _shingles(entry)
+        if _is_near_duplicate(shingles, seen):
+            duplicates += 1
+            continue
+
+        cost = count_tokens(_render(entry)) + 1
+        if used + cost > token_budget:
+            break
+
+        seen.append(shingles)
+        entries.append(entry)
+        full_answers.append((hit.payload or {}).get("full_answer", ""))
+        used += cost
+
+    if include_full_answer:
+        attached = set()
+        for entry, full_answer in zip(entries, full_answers):
+            document = entry.get("url") or full_answer
+            if not full_answer or document in attached:
+                continue
+
+            cost = count_tokens(_render({**entry, "full_answer": full_answer}))
+            cost -= count_tokens(_render(entry))
+            if used + cost > token_budget:
+                continue
+
+            entry["full_answer"] = full_answer
+            attached.add(document)
+            used += cost
+
+    logger.info(
+        f"Hits context: {len(entries)}/{len(hits)} hits, "
+        f"{duplicates} duplicates, ~{used} tokens"
+    )
+    if not entries:
+        return "[]"
+    return "[\n" + ",\n".join(_render(entry) for entry in entries) + "\n]"
@@ -1,23 +1,43 @@
-from typing import Generator, List, Dict, Any
+from typing import Generator, List, Dict, Any, Optional, Tuple, Type
 from datetime import datetime, timedelta
+import queue
+import threading
+import time
 from sqlalchemy import (
     create_engine,
+    insert,
     Column,
     Integer,
     String,
     Text,
+    Date,
     DateTime,
     SmallInteger,
+    Index,
+    and_,
+    inspect,
+    or_,
+    text,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from contextlib import contextmanager
 import logging
 from ragapp.common.config import app_config
+from ragapp.common.metrics import metrics
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+# Search history paging configuration
+HISTORY_PAGE_SIZE = 1000
+HISTORY_MAX_PAGE_SIZE = 5000
+
+# Write-behind buffer configuration
+WRITE_BATCH_SIZE = 200  # Flush once this many rows are pending
+WRITE_FLUSH_INTERVAL = 1.0  # Flush at least every second
+WRITE_MAX_PENDING = 20000  # Drop new rows beyond this many pending rows
+
 Base = declarative_base()
 
 
@@ -33,6 +53,17 @@ class SearchHistory(Base):
     session_id = Column(String(36))
     session_index = Column(Integer)
     create_time = Column(DateTime, default=datetime.now)
+    # Set when the buffered row is inserted; create_time is when it was queued
+    insert_time = Column(DateTime)
+
+    # Keyset pagination walks (create_time, id); filters narrow it further
+    __table_args__ = (
+        Index("ix_SearchHistory_create_time_id", "create_time", "id"),
+        Index(
+            "ix_SearchHistory_product_create_time_id", "product", "create_time", "id"
+        ),
+        Index("ix_SearchHistory_session_id", "session_id"),
+    )
 
 
 class QAFeedback(Base):
@@ -47,6 +78,207 @@ class QAFeedback(Base):
     comments = Column(Text)
     product = Column(String(32))
     create_time = Column(DateTime, default=datetime.now)
+    # Set when the buffered row is inserted; create_time is when it was queued
+    insert_time = Column(DateTime)
+
+
+class WriteBehindBuffer:
+    """Buffers inserts in memory and writes them in bulk on a worker thread.
+
+    Rows are flushed when a batch is full or the flush interval elapses. The
+    queue is bounded: when the database cannot keep up, new rows are dropped
+    and counted instead of holding request handling.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        batch_size: int = WRITE_BATCH_SIZE,
+        flush_interval: float = WRITE_FLUSH_INTERVAL,
+        max_pending: int = WRITE_MAX_PENDING,
+    ):
+        """Initialize the buffer.
+
+        Args:
+            session_factory: Context manager factory yielding a session
+            batch_size: Maximum number of rows written per flush
+            flush_interval: Maximum seconds a row waits before being written
+            max_pending: Maximum number of rows waiting in memory
+        """
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[Tuple[Type, Dict[str, Any]]]]" = queue.Queue(
+            maxsize=max_pending
+        )
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="db-write-behind", daemon=True
+                )
+                self._thread.start()
+
+    def put(self, model: Type, row: Dict[str, Any]) -> bool:
+        """Queue a row for insertion.
+
+        Args:
+            model: The model class of the row
+            row: Column values of the row
+
+        Returns:
+            bool: True if queued, False if dropped because the buffer is full
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((model, row))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            metrics.incr(f"db.write_behind.dropped.{model.__tablename__}")
+            return False
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: List[Tuple[Type, Dict[str, Any]]] = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(timeout, 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            if batch:
+                self._flush(batch)
+
+        # Write whatever was queued before the stop marker
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                remaining.append(item)
+        for i in range(0, len(remaining), self.batch_size):
+            self._flush(remaining[i : i + self.batch_size])
+
+    def _flush(self, batch: List[Tuple[Type, Dict[str, Any]]]) -> None:
+        rows_by_model: Dict[Type, List[Dict[str, Any]]] = {}
+        for model, row in batch:
+            rows_by_model.setdefault(model, []).append(row)
+
+        for model, rows in rows_by_model.items():
+            if "insert_time" in model.__table__.c:
+                now = datetime.now()
+                rows = [dict(row, insert_time=now) for row in rows]
+            try:
+                with self.session_factory() as session:
+                    session.execute(insert(model), rows)
+                self.written += len(rows)
+            except Exception as e:
+                self.failed += len(rows)
+                metrics.incr(f"db.write_behind.failed.{model.__tablename__}", len(rows))
+                logger.error(
+                    f"Error occurred while bulk inserting {len(rows)} rows "
+                    f"into {model.__tablename__}: {e}"
+                )
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Flush pending rows and stop the worker thread.
+
+        Args:
+            timeout: Maximum seconds to wait for the final flush
+        """
+        with self._lock:
+            thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        # Block for the stop marker so it is not lost when the queue is full
+        self._queue.put(None)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning("Write-behind buffer did not finish flushing in time")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+class QueryDailyRollup(Base):
+    """Daily query and new-session counts per product and mode."""
+
+    __tablename__ = "QueryDailyRollup"
+
+    day = Column(Date, primary_key=True)
+    product = Column(String(32), primary_key=True)
+    mode = Column(String(32), primary_key=True)
+    query_count = Column(Integer, nullable=False, default=0)
+    session_count = Column(Integer, nullable=False, default=0)
+
+
+class TopQueryDailyRollup(Base):
+    """Daily counts per product and normalized query."""
+
+    __tablename__ = "TopQueryDailyRollup"
+
+    day = Column(Date, primary_key=True)
+    product = Column(String(32), primary_key=True)
+    query_hash = Column(String(64), primary_key=True)
+    query = Column(Text, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_TopQueryDailyRollup_day_product_count", "day", "product", "count"),
+    )
+
+
+class SessionDepthDailyRollup(Base):
+    """Daily number of sessions per product that reached each turn depth."""
+
+    __tablename__ = "SessionDepthDailyRollup"
+
+    day = Column(Date, primary_key=True)
+    product = Column(String(32), primary_key=True)
+    depth = Column(Integer, primary_key=True)
+    session_count = Column(Integer, nullable=False, default=0)
+
+
+class FeedbackDailyRollup(Base):
+    """Daily feedback counts per product and rating."""
+
+    __tablename__ = "FeedbackDailyRollup"
+
+    day = Column(Date, primary_key=True)
+    product = Column(String(32), primary_key=True)
+    rating = Column(SmallInteger, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class RollupWatermark(Base):
+    """Last raw record id folded into the rollups, per source table."""
+
+    __tablename__ = "RollupWatermark"
+
+    name = Column(String(64), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    update_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
 class Database:
@@ -62,9 +294,47 @@ class Database:
 
             # Create all tables
             Base.metadata.create_all(bind=self.engine)
+
+            # create_all skips existing tables, so add columns and indexes
+            # introduced later
+            self._ensure_columns()
+            self._ensure_indexes()
         except Exception as e:
             logger.exception("Initilized database failed", e)
 
+        self.write_buffer = WriteBehindBuffer(self.get_session)
+        metrics.register("db.write_behind", self.write_buffer.stats)
+
+    def _ensure_columns(self) -> None:
+        """Add the nullable model columns missing from tables created earlier."""
+        inspector = inspect(self.engine)
+        quote = self.engine.dialect.identifier_preparer.quote
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=self.engine.dialect)
+                try:
+                    with self.engine.begin() as conn:
+                        conn.execute(
+                            text(
+                                f"ALTER TABLE {quote(table.name)} "
+                                f"ADD COLUMN {quote(column.name)} {column_type}"
+                            )
+                        )
+                except Exception as e:
+                    logger.error(f"Error adding column {table.name}.{column.name}: {e}")
+
+    def _ensure_indexes(self) -> None:
+        """Create the model indexes missing from tables created earlier."""
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(bind=self.engine, checkfirst=True)
+                except Exception as e:
+                    logger.error(f"Error creating index {index.name}: {e}")
+
     @contextmanager
     def get_session(self) -> Generator[Session, None, None]:
         """Context manager for database sessions.
@@ -86,7 +356,7 @@ class Database:
     def add_search_history(
         self, query: str, mode: str, product: str, session_id: str, session_index: int
     ) -> bool:
-        """Add a search history record to the database.
+        """Queue a search history record for a batched insert.
 
         Args:
             query: The search query
@@ -96,27 +366,24 @@ class Database:
             session_index: The session index
 
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if queued, False if dropped because the buffer is full
         """
-        try:
-            with self.get_session() as session:
-                history = SearchHistory(
-                    query=query,
-                    mode=mode,
-                    product=product,
-                    session_id=session_id,
-                    session_index=session_index,
-                )
-                session.add(history)
-            return True
-        except Exception as e:
-            logger.error(f"Error occurred while inserting into SearchHistory: {e}")
-            return False
+        return self.write_buffer.put(
+            SearchHistory,
+            {
+                "query": query,
+                "mode": mode,
+                "product": product,
+                "session_id": session_id,
+                "session_index": session_index,
+                "create_time": datetime.now(),
+            },
+        )
 
     def add_qa_feedback(
         self, question: str, answer: str, rating: int, comments: str, product: str
     ) -> bool:
-        """Add a QA feedback record to the database.
+        """Queue a QA feedback record for a batched insert.
 
         Args:
             question: The question text
@@ -126,22 +393,24 @@ class Database:
             product: The product name
 
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if queued, False if dropped because the buffer is full
         """
-        try:
-            with self.get_session() as session:
-                feedback = QAFeedback(
-                    question=question,
-                    answer=answer,
-                    rating=rating,
-                    comments=comments,
-                    product=product,
-                )
-                session.add(feedback)
-            return True
-        except Exception as e:
-            logger.error(f"Error occurred while inserting into QAFeedback: {e}")
-            return False
+        return self.write_buffer.put(
+            QAFeedback,
+            {
+                "question": question,
+                "answer": answer,
+                "rating": rating,
+                "comments": comments,
+                "product": product,
+                "create_time": datetime.now(),
+            },
+        )
+
+    def close(self) -> None:
+        """Flush queued records and release the connection pool."""
+        self.write_buffer.stop()
+        self.engine.dispose()
 
     def get_search_history_by_date(self, date: str) -> List[Dict[str, Any]]:
         """Get search history records for a specific date.
@@ -188,6 +457,134 @@ class Database:
             logger.error(f"Error occurred while querying SearchHistory: {e}")
             return []
 
+    def get_search_history_page(
+        self,
+        start: datetime,
+        end: datetime,
+        product: str = "",
+        mode: str = "",
+        session_id: str = "",
+        after: Optional[Tuple[datetime, int]] = None,
+        limit: int = HISTORY_PAGE_SIZE,
+    ) -> List[Dict[str, Any]]:
+        """Get one page of search history ordered by (create_time, id).
+
+        Args:
+            start: Inclusive lower bound of create_time
+            end: Exclusive upper bound of create_time
+            product: Only return records of this product if set
+            mode: Only return records of this mode if set
+            session_id: Only return records of this session if set
+            after: (create_time, id) of the last record of the previous page
+            limit: Maximum number of records returned
+
+        Returns:
+            List[Dict[str, Any]]: List of search history records
+        """
+        filters = [SearchHistory.create_time >= start, SearchHistory.create_time < end]
+        if product:
+            filters.append(SearchHistory.product == product)
+        if mode:
+            filters.append(SearchHistory.mode == mode)
+        if session_id:
+            filters.append(SearchHistory.session_id == session_id)
+        if after is not None:
+            after_time, after_id = after
+            filters.append(
+                or_(
+                    SearchHistory.create_time > after_time,
+                    and_(
+                        SearchHistory.create_time == after_time,
+                        SearchHistory.id > after_id,
+                    ),
+                )
+            )
+
+        with self.get_session() as session:
+            results = (
+                session.query(SearchHistory)
+                .filter(*filters)
+                .order_by(SearchHistory.create_time, SearchHistory.id)
+                .limit(min(limit, HISTORY_MAX_PAGE_SIZE))
+                .all()
+            )
+            return [_search_history_record(r) for r in results]
+
+    def iter_search_history(
+        self,
+        start: datetime,
+        end: datetime,
+        product: str = "",
+        mode: str = "",
+        session_id: str = "",
+        page_size: int = HISTORY_PAGE_SIZE,
+    ) -> Generator[Dict[str, Any], None, None]:
+        """Iterate over search history records page by page.
+
+        Only one page is held in memory at a time, and every page is read in
+        its own short session.
+
+        Args:
+            start: Inclusive lower bound of create_time
+            end: Exclusive upper bound of create_time
+            product: Only return records of this product if set
+            mode: Only return records of this mode if set
+            session_id: Only return records of this session if set
+            page_size: Number of records read per query
+
+        Yields:
+            Dict[str, Any]: Search history records ordered by (create_time, id)
+        """
+        page_size = min(page_size, HISTORY_MAX_PAGE_SIZE)
+        after = None
+        while True:
+            page = self.get_search_history_page(
+                start, end, product, mode, session_id, after, page_size
+            )
+            yield from page
+            if len(page) < page_size:
+                return
+            after = (page[-1]["create_time"], page[-1]["id"])
+
+
+def _search_history_record(r: SearchHistory) -> Dict[str, Any]:
+    return {
+        "id": r.id,
+        "query": r.query,
+        "mode": r.mode,
+        "product": r.product,
+        "session_id": r.session_id,
+        "session_index": r.session_index,
+        "create_time": r.create_time,
+    }
+
+
+def parse_date(date: str) -> datetime:
+    """Parse a date in format 'YYYY/MM/DD' or 'YYYY-MM-DD'.
+
+    Raises:
+        ValueError: If the date matches neither format
+    """
+    try:
+        return datetime.strptime(date, "%Y/%m/%d")
+    except ValueError:
+        return datetime.strptime(date, "%Y-%m-%d")
+
+
+def encode_history_cursor(record: Dict[str, Any]) -> str:
+    """Encode the keyset position after a search history record."""
+    return f"{record['create_time'].isoformat()}_{record['id']}"
+
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor produced by encode_history_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    create_time, record_id = cursor.rsplit("_", 1)
+    return datetime.fromisoformat(create_time), int(record_id)
+
 
 # Create a global database instance
 db = Database()
@@ -1,6 +1,10 @@
 from http import HTTPStatus
 from typing import Generator, List, Optional, Dict, Any
+import httpx
+import dashscope
 from dashscope import TextEmbedding
+from dashscope.api_entities.dashscope_response import DashScopeAPIResponse
+from ragapp.common.cache import create_cache, make_cache_key, normalize_text
 from ragapp.common.config import app_config
 
 # Default configuration
@@ -8,6 +12,19 @@ DEFAULT_BATCH_SIZE = 10
 DEFAULT_DIMENSION = 1024
 DEFAULT_OUTPUT_TYPE = "dense&sparse"
 DEFAULT_MODEL_NAME = "text-embedding-v4"
+DEFAULT_TIMEOUT = 30.0
+
+# DashScope text embedding REST path, relative to dashscope.base_http_api_url
+TEXT_EMBEDDING_PATH = "/services/embeddings/text-embedding/text-embedding"
+
+# Query embedding cache configuration
+EMBEDDING_CACHE_SIZE = 10000
+EMBEDDING_CACHE_TTL = 24 * 60 * 60  # Cache for 1 day
+
+_async_http_client: Optional[httpx.AsyncClient] = None
+_embedding_cache = create_cache(
+    "embedding", maxsize=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL
+)
 
 
 class EmbeddingError(Exception):
@@ -84,3 +101,159 @@ def create_embedding(
         raise EmbeddingError("No embeddings were generated")
 
     return result
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Get the shared HTTP client used for async embedding requests.
+
+    Returns:
+        httpx.AsyncClient: Lazily created client with a keep-alive pool
+    """
+    global _async_http_client
+    if _async_http_client is None:
+        _async_http_client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT)
+    return _async_http_client
+
+
+async def _call_text_embedding_async(
+    batch: List[str], dimension: int, output_type: str
+) -> DashScopeAPIResponse:
+    """Call the DashScope text embedding API without blocking the event loop.
+
+    Args:
+        batch: Texts to embed in a single request
+        dimension: Dimension of the embedding vectors
+        output_type: Type of embedding output
+
+    Returns:
+        DashScopeAPIResponse: Response shaped like TextEmbedding.call's result
+    """
+    resp = await get_async_http_client().post(
+        f"{dashscope.base_http_api_url}{TEXT_EMBEDDING_PATH}",
+        headers={"Authorization": f"Bearer {app_config.embedding.api_key}"},
+        json={
+            "model": DEFAULT_MODEL_NAME,
+            "input": {"texts": batch},
+            "parameters": {"dimension": dimension, "output_type": output_type},
+        },
+    )
+
+    try:
+        body = resp.json()
+    except ValueError:
+        body = {"message": resp.text}
+
+    return DashScopeAPIResponse(
+        status_code=resp.status_code,
+        request_id=body.get("request_id", ""),
+        code=body.get("code", ""),
+        message=body.get("message", ""),
+        output=body.get("output"),
+        usage=body.get("usage"),
+    )
+
+
+async def create_embedding_async(
+    texts: List[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    dimension: int = DEFAULT_DIMENSION,
+    output_type: str = DEFAULT_OUTPUT_TYPE,
+) -> DashScopeAPIResponse:
+    """Async counterpart of create_embedding.
+
+    Args:
+        texts: List of texts to embed
+        batch_size: Number of texts to process in each batch
+        dimension: Dimension of the embedding vectors
+        output_type: Type of embedding output
+
+    Returns:
+        DashScopeAPIResponse containing the embeddings and usage information
+
+    Raises:
+        EmbeddingError: If the embedding process fails
+    """
+    if not texts:
+        raise EmbeddingError("No texts provided for embedding")
+
+    result: Optional[DashScopeAPIResponse] = None
+    batch_counter = 0
+
+    for batch in batched(texts, batch_size):
+        try:
+            resp = await _call_text_embedding_async(batch, dimension, output_type)
+        except httpx.HTTPError as e:
+            raise EmbeddingError(f"Embedding failed: {e}") from e
+
+        if resp.status_code != HTTPStatus.OK:
+            raise EmbeddingError(f"Embedding failed: {resp.message}")
+
+        if result is None:
+            result = resp
+        else:
+            for emb in resp.output["embeddings"]:
+                emb["text_index"] += batch_counter
+                result.output["embeddings"].append(emb)
+            result.usage["total_tokens"] += resp.usage["total_tokens"]
+
+        batch_counter += len(batch)
+
+    if result is None:
+        raise EmbeddingError("No embeddings were generated")
+
+    return result
+
+
+def _embedding_cache_key(text: str, dimension: int, output_type: str) -> str:
+    return make_cache_key(DEFAULT_MODEL_NAME, dimension, output_type, text)
+
+
+def _to_cached_embedding(emb: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "embedding": emb.get("embedding", []),
+        "sparse_embedding": emb.get("sparse_embedding", []),
+    }
+
+
+async def get_query_embeddings_async(
+    texts: List[str],
+    dimension: int = DEFAULT_DIMENSION,
+    output_type: str = DEFAULT_OUTPUT_TYPE,
+) -> List[Dict[str, Any]]:
+    """Get query embeddings, serving repeated queries from the embedding cache.
+
+    Texts are normalized before lookup and embedding, so queries that only
+    differ in whitespace or Unicode form share one cache entry.
+
+    Args:
+        texts: List of query texts
+        dimension: Dimension of the embedding vectors
+        output_type: Type of embedding output
+
+    Returns:
+        List of {"embedding", "sparse_embedding"} dicts, one per input text
+
+    Raises:
+        EmbeddingError: If the embedding process fails
+    """
+    normalized = [normalize_text(text) for text in texts]
+    keys = [_embedding_cache_key(text, dimension, output_type) for text in normalized]
+
+    found = {}
+    for text, key in zip(normalized, keys):
+        if text not in found:
+            found[text] = await _embedding_cache.aget(key)
+
+    missing = [text for text, value in found.items() if value is None]
+    if missing:
+        resp = await create_embedding_async(
+            missing, dimension=dimension, output_type=output_type
+        )
+        for emb in resp.output["embeddings"]:
+            text = missing[emb["text_index"]]
+            found[text] = _to_cached_embedding(emb)
+            await _embedding_cache.aset(
+                _embedding_cache_key(text, dimension, output_type), found[text]
+            )
+
+    return [found[text] for text in normalized]
@@ -1,11 +1,17 @@
+import time
+import logging
 from dataclasses import dataclass
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
 from limits import RateLimitItemPerMinute, RateLimitItemPerHour, RateLimitItemPerDay
 from limits.storage import MemoryStorage
 from limits.strategies import MovingWindowRateLimiter
-from typing import Dict, TypeVar, Callable
+from typing import Any, Dict, List, Tuple, Union
+from ragapp.common.cache import SHARED_KEY_PREFIX
+from ragapp.common.config import app_config
+from ragapp.common.metrics import metrics
 
-T = TypeVar("T")
+# Initialize logger
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -15,8 +21,17 @@ class RateLimitConfig:
     qpd: int  # Queries per day
 
 
-# Rate limit configurations
+# Rate limit configurations, per client and endpoint
 RATE_LIMITS: Dict[str, RateLimitConfig] = {
+    "search": RateLimitConfig(qpm=60, qph=1000, qpd=10000),
+    "chat": RateLimitConfig(qpm=20, qph=200, qpd=1000),
+    "think": RateLimitConfig(qpm=20, qph=200, qpd=1000),
+    "research": RateLimitConfig(qpm=10, qph=100, qpd=500),
+    "feedback": RateLimitConfig(qpm=60, qph=1000, qpd=10000),
+}
+
+# Rate limit configurations, per endpoint over all clients
+GLOBAL_RATE_LIMITS: Dict[str, RateLimitConfig] = {
     "search": RateLimitConfig(qpm=600, qph=10000, qpd=100000),
     "chat": RateLimitConfig(qpm=300, qph=1000, qpd=5000),
     "think": RateLimitConfig(qpm=300, qph=1000, qpd=5000),
@@ -25,34 +40,250 @@ RATE_LIMITS: Dict[str, RateLimitConfig] = {
 }
 
 
-class RateLimiter:
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int  # Limit of the window closest to exhaustion
+    remaining: int  # Requests left in that window
+    reset: int  # Seconds until that window frees up
+
+
+def get_client_key(request: Request) -> str:
+    """Identify the client of a request by its address.
+
+    Behind GC_QA_RAG.TRUSTED_PROXY_HOPS reverse proxies, the X-Forwarded-For
+    entry appended by the outermost trusted proxy is used. Entries left of it
+    are sent by the client and ignored, so that clients cannot claim a new
+    quota by sending a new address.
+    """
+    hops = app_config.trusted_proxy_hops
+    if hops > 0:
+        forwarded = [
+            entry.strip()
+            for entry in request.headers.get("x-forwarded-for", "").split(",")
+            if entry.strip()
+        ]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    if request.client:
+        return request.client.host
+    return ""
+
+
+# A counted window: (counter key, limit, window seconds)
+Window = Tuple[str, int, int]
+
+
+def _windows(key: str, config: RateLimitConfig) -> List[Window]:
+    """Get the windows of a config counted under a key."""
+    return [
+        (key, config.qpm, 60),
+        (key, config.qph, 60 * 60),
+        (key, config.qpd, 24 * 60 * 60),
+    ]
+
+
+def _tightest(
+    windows: List[Window], used: List[float], resets: List[float], allowed
+) -> RateLimitResult:
+    index = min(range(len(windows)), key=lambda i: windows[i][1] - used[i])
+    limit = windows[index][1]
+    return RateLimitResult(
+        allowed=allowed,
+        limit=limit,
+        remaining=max(0, int(limit - used[index])),
+        reset=max(1, round(resets[index])),
+    )
+
+
+class MemoryRateLimitStorage:
+    """Moving window counters kept in this process.
+
+    Limits apply per worker, so this backend suits single-worker deployments
+    and tests.
+    """
+
     def __init__(self):
         self.storage = MemoryStorage()
         self.rate_limiter = MovingWindowRateLimiter(self.storage)
-        self._init_rate_limit_items()
-
-    def _init_rate_limit_items(self):
-        self.rate_limit_items = {}
-        for endpoint, config in RATE_LIMITS.items():
-            self.rate_limit_items[endpoint] = {
-                "qpm": RateLimitItemPerMinute(config.qpm, 1),
-                "qph": RateLimitItemPerHour(config.qph, 1),
-                "qpd": RateLimitItemPerDay(config.qpd, 1),
-            }
-
-    def _check_rate_limit(self, endpoint: str) -> None:
-        items = self.rate_limit_items[endpoint]
-        if not all(self.rate_limiter.hit(item, endpoint) for item in items.values()):
-            raise HTTPException(status_code=429, detail="Too Many Requests")
-
-    def __getattr__(self, name: str) -> Callable[[], None]:
-        if name.startswith("hit_") and name[4:] in RATE_LIMITS:
-            endpoint = name[4:]
-            return lambda: self._check_rate_limit(endpoint)
-        raise AttributeError(
-            f"'{self.__class__.__name__}' object has no attribute '{name}'"
-        )
+        self._items: Dict[Tuple[int, int], Any] = {}
+
+    def _item(self, limit: int, seconds: int):
+        item = self._items.get((limit, seconds))
+        if item is None:
+            if seconds == 60:
+                item = RateLimitItemPerMinute(limit, 1)
+            elif seconds == 60 * 60:
+                item = RateLimitItemPerHour(limit, 1)
+            else:
+                item = RateLimitItemPerDay(limit, 1)
+            self._items[(limit, seconds)] = item
+        return item
+
+    async def hit(self, windows: List[Window]) -> RateLimitResult:
+        items = [
+            (self._item(limit, seconds), key) for key, limit, seconds in windows
+        ]
+        # Nothing awaits between the test and the hits, so they are atomic
+        allowed = all(self.rate_limiter.test(item, key) for item, key in items)
+        if allowed:
+            for item, key in items:
+                self.rate_limiter.hit(item, key)
+
+        now = time.time()
+        used, resets = [], []
+        for item, key in items:
+            reset_time, remaining = self.rate_limiter.get_window_stats(item, key)
+            used.append(item.amount - remaining)
+            resets.append(reset_time - now)
+        return _tightest(windows, used, resets, allowed)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory"}
+
+
+# Sliding window counters: a window's count is estimated from the current
+# fixed window plus the overlapping share of the previous one. All windows
+# are checked before any is incremented, in one atomic round trip.
+# KEYS: current and previous counter of every window
+# ARGV: now, then limit and seconds of every window
+_SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local count = (#ARGV - 1) / 2
+local used = {}
+local allowed = 1
+for i = 1, count do
+    local limit = tonumber(ARGV[2 * i])
+    local seconds = tonumber(ARGV[2 * i + 1])
+    local current = tonumber(redis.call('GET', KEYS[2 * i - 1]) or '0')
+    local previous = tonumber(redis.call('GET', KEYS[2 * i]) or '0')
+    local weight = 1 - (now % seconds) / seconds
+    used[i] = previous * weight + current
+    if used[i] + 1 > limit then
+        allowed = 0
+    end
+end
+if allowed == 1 then
+    for i = 1, count do
+        local seconds = tonumber(ARGV[2 * i + 1])
+        redis.call('INCR', KEYS[2 * i - 1])
+        redis.call('EXPIRE', KEYS[2 * i - 1], seconds * 2)
+        used[i] = used[i] + 1
+    end
+end
+local result = {allowed}
+for i = 1, count do
+    result[i + 1] = tostring(used[i])
+end
+return result
+"""
+
+
+class RedisRateLimitStorage:
+    """Sliding window counters shared by all workers through a Redis server.
+
+    Backend errors are logged and the request is allowed, so an unavailable
+    store disables rate limiting instead of the API.
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio
+
+        self.prefix = f"{SHARED_KEY_PREFIX}:ratelimit:"
+        self._client = redis.asyncio.Redis.from_url(url)
+        self._script = self._client.register_script(_SLIDING_WINDOW_SCRIPT)
+        self.errors = 0
+
+    async def hit(self, windows: List[Window]) -> RateLimitResult:
+        now = time.time()
+        keys, args = [], [now]
+        resets = []
+        for key, limit, seconds in windows:
+            index = int(now // seconds)
+            keys.append(f"{self.prefix}{key}:{seconds}:{index}")
+            keys.append(f"{self.prefix}{key}:{seconds}:{index - 1}")
+            args.extend([limit, seconds])
+            resets.append((index + 1) * seconds - now)
+
+        try:
+            result = await self._script(keys=keys, args=args)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Rate limit check failed, allowing request: {e}")
+            _, limit, seconds = windows[0]
+            return RateLimitResult(True, limit, limit, seconds)
+
+        used = [float(value) for value in result[1:]]
+        return _tightest(windows, used, resets, bool(result[0]))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis", "errors": self.errors}
+
+
+RateLimitStorage = Union[MemoryRateLimitStorage, RedisRateLimitStorage]
+
+
+def create_rate_limit_storage() -> RateLimitStorage:
+    """Create the shared backend if one is configured, else a local one."""
+    redis_url = app_config.cache.redis_url
+    if redis_url:
+        try:
+            return RedisRateLimitStorage(redis_url)
+        except ImportError:
+            logger.warning(
+                "Package redis is not installed, rate limits stay in-process"
+            )
+    return MemoryRateLimitStorage()
+
+
+class RateLimiter:
+    def __init__(self, storage: RateLimitStorage = None):
+        self.storage = storage or create_rate_limit_storage()
+        self.allowed = 0
+        self.rejected = 0
+
+    async def hit(self, endpoint: str, client: str) -> Dict[str, str]:
+        """Count a request of a client against the endpoint's limits.
+
+        The request counts against the client's limits and the endpoint's
+        global limits, and is only counted if none of them is exhausted.
+
+        Args:
+            endpoint: Name of the endpoint in RATE_LIMITS
+            client: Key identifying the client, see get_client_key
+
+        Returns:
+            Dict[str, str]: X-RateLimit headers for the response
+
+        Raises:
+            HTTPException: 429 if a limit is exhausted
+        """
+        windows = _windows(f"{endpoint}:{client}", RATE_LIMITS[endpoint])
+        windows += _windows(f"{endpoint}:*", GLOBAL_RATE_LIMITS[endpoint])
+        result = await self.storage.hit(windows)
+        headers = {
+            "X-RateLimit-Limit": str(result.limit),
+            "X-RateLimit-Remaining": str(result.remaining),
+            "X-RateLimit-Reset": str(result.reset),
+        }
+        if not result.allowed:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too Many Requests",
+                headers={**headers, "Retry-After": str(result.reset)},
+            )
+        self.allowed += 1
+        return headers
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.storage.stats(),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
 
 
 # Create a singleton instance
 rate_limiter = RateLimiter()
+metrics.register("rate_limiter", rate_limiter.stats)
@@ -1,4 +1,132 @@
 import json
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, List
+from ragapp.common.config import app_config
+from ragapp.common.metrics import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Interval of heartbeat events while no chunk is produced, in seconds
+HEARTBEAT_INTERVAL = 5
+
+
+@dataclass
+class SSEEvent:
+    """A typed SSE event sent alongside the default text messages."""
+
+    event: str
+    data: Any
+
+
+def dumps(data: Any) -> str:
+    """Serialize to JSON with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False)
+
+
+def format_sse(item) -> str:
+    """Format a text chunk or an SSEEvent as an SSE frame."""
+    if isinstance(item, SSEEvent):
+        return f"event: {item.event}\ndata: {dumps(item.data)}\n\n"
+
+    # Format the text as SSE compliant JSON
+    return f"data: {dumps({'text': item})}\n\n"
+
+
+class _ChunkReader:
+    """Reads a chat stream on a task so that consumers can wait with timeouts.
+
+    Chunks are buffered as they arrive; a consumer takes everything buffered
+    at once instead of paying a wakeup and a frame per chunk.
+    """
+
+    def __init__(self, chat_method, *args, **kwargs):
+        self.chunks = deque()
+        self.text_size = 0
+        self.event_count = 0
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run(chat_method, *args, **kwargs))
+
+    async def _run(self, chat_method, *args, **kwargs):
+        result_gen = None
+        try:
+            result_gen = await chat_method(*args, **kwargs)
+            async for chunk in result_gen:
+                self.chunks.append(chunk)
+                if isinstance(chunk, SSEEvent):
+                    self.event_count += 1
+                else:
+                    self.text_size += len(chunk)
+                self._changed.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            # Closing the upstream generator closes the model's HTTP stream
+            if result_gen is not None and hasattr(result_gen, "aclose"):
+                await result_gen.aclose()
+            self.done = True
+            self._changed.set()
+
+    async def wait(self, timeout: float = None) -> bool:
+        """
+        Wait until a chunk is buffered or the stream ends.
+
+        :param timeout: Seconds to wait at most, None waits indefinitely.
+        :return: False if the timeout expired first.
+        """
+        while not self.chunks and not self.done:
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def wait_for_flush(self, interval: float, size: int) -> None:
+        """
+        Keep buffering until the interval passes, size characters of text are
+        buffered, an event arrives or the stream ends.
+        """
+        deadline = time.monotonic() + interval
+        while not self.done and self.text_size < size and not self.event_count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    def take(self) -> List:
+        chunks = list(self.chunks)
+        self.chunks.clear()
+        self.text_size = 0
+        self.event_count = 0
+        return chunks
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    async def close(self) -> None:
+        """Stop reading, cancelling the upstream stream if it is still running."""
+        if not self._task.done():
+            self._task.cancel()
+            await asyncio.wait({self._task})
 
 
 async def get_llm_full_result(chat_method, *args, **kwargs):
@@ -22,13 +150,119 @@ async def get_llm_full_result(chat_method, *args, **kwargs):
     return await wrapper()
 
 
+def _coalesce(chunks: List) -> List:
+    """Merge consecutive text chunks, keeping events in place."""
+    merged = []
+    texts = []
+    for chunk in chunks:
+        if isinstance(chunk, SSEEvent):
+            if texts:
+                merged.append("".join(texts))
+                texts = []
+            merged.append(chunk)
+        else:
+            texts.append(chunk)
+    if texts:
+        merged.append("".join(texts))
+    return merged
+
+
 async def get_llm_sse_result(chat_method, *args, **kwargs):
+    """
+    Stream the result of chat_method as SSE frames.
+
+    The first text chunk is sent immediately. After that, text chunks are
+    merged into one frame per flush interval, or earlier once the buffered
+    text reaches the flush size. Typed events are sent without delay.
+
+    :param chat_method: An async function responsible for generating the result stream.
+    :param args: Positional arguments passed to chat_method.
+    :param kwargs: Keyword arguments passed to chat_method.
+    :return: An async iterator over SSE frames.
+    """
+    flush_interval = app_config.sse.flush_interval_ms / 1000
+    flush_size = app_config.sse.flush_size
+
     async def wrapper():
-        result_gen = await chat_method(*args, **kwargs)
+        reader = _ChunkReader(chat_method, *args, **kwargs)
+        first_text_sent = False
+        try:
+            while True:
+                await reader.wait()
+                if first_text_sent:
+                    await reader.wait_for_flush(flush_interval, flush_size)
 
-        async for text in result_gen:
-            # Format the text as SSE compliant JSON
-            sse_message = f"data: {json.dumps({'text': text}, ensure_ascii=False)}\n\n"
-            yield sse_message
+                chunks = reader.take()
+                if not chunks:
+                    break
+
+                for chunk in _coalesce(chunks):
+                    if not isinstance(chunk, SSEEvent):
+                        first_text_sent = True
+                    yield format_sse(chunk)
+
+            reader.raise_error()
+        except Exception:
+            metrics.incr("llm.generation.failed")
+            raise
+        finally:
+            # Counted before awaiting, a cancelled response may not resume
+            if not reader.done:
+                metrics.incr("llm.generation.aborted")
+                logger.info("Generation aborted by client disconnect")
+            elif reader.error is None:
+                metrics.incr("llm.generation.completed")
+            await reader.close()
+
+    return wrapper()
+
+
+async def stream_events(prelude: List[SSEEvent], chat_method, *args, **kwargs):
+    """
+    Wrap the stream of chat_method with typed events.
+
+    The prelude events are sent immediately. Until chat_method produces its
+    first chunk, and whenever it is idle afterwards, a heartbeat event is
+    sent every HEARTBEAT_INTERVAL seconds. Timing events report the time to
+    the first chunk and the total time of the stream.
+
+    :param prelude: Events sent before the stream starts.
+    :param chat_method: An async function responsible for generating the result stream.
+    :param args: Positional arguments passed to chat_method.
+    :param kwargs: Keyword arguments passed to chat_method.
+    :return: An async iterator over text chunks and SSEEvents.
+    """
+
+    async def wrapper():
+        started = time.monotonic()
+        for event in prelude:
+            yield event
+
+        reader = _ChunkReader(chat_method, *args, **kwargs)
+        first = True
+        try:
+            while True:
+                if not await reader.wait(HEARTBEAT_INTERVAL):
+                    elapsed = round((time.monotonic() - started) * 1000)
+                    yield SSEEvent("heartbeat", {"elapsed_ms": elapsed})
+                    continue
+
+                chunks = reader.take()
+                if not chunks:
+                    break
+
+                for chunk in chunks:
+                    if first and not isinstance(chunk, SSEEvent):
+                        first = False
+                        elapsed = round((time.monotonic() - started) * 1000)
+                        yield SSEEvent("timing", {"first_token_ms": elapsed})
+                    yield chunk
+
+            reader.raise_error()
+        finally:
+            await reader.close()
+
+        elapsed = round((time.monotonic() - started) * 1000)
+        yield SSEEvent("timing", {"total_ms": elapsed})
 
     return wrapper()
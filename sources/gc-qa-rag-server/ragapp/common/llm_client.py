@@ -0,0 +1,409 @@
+import time
+import random
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+import httpx
+from openai import AsyncOpenAI
+from ragapp.common.config import LlmConfig, app_config
+from ragapp.common.metrics import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Connection pool shared by every LLM endpoint
+LLM_MAX_CONNECTIONS = 200
+LLM_MAX_KEEPALIVE_CONNECTIONS = 50
+LLM_KEEPALIVE_EXPIRY = 60  # Idle connections are kept for 60 seconds
+
+# Deadlines of one generation, in seconds
+LLM_CONNECT_TIMEOUT = 5
+LLM_READ_TIMEOUT = 60  # Longest silence between two chunks
+LLM_FIRST_TOKEN_TIMEOUT = 60  # Reasoning models may think for a while
+LLM_TOTAL_TIMEOUT = 300
+
+LLM_MAX_RETRIES = 2  # Retries of requests failing before the stream starts
+LLM_MAX_CONCURRENCY = 32  # Concurrent generations per endpoint
+
+# Routing between the endpoints of a role
+LLM_EWMA_ALPHA = 0.2  # Weight of the latest sample in the moving averages
+LLM_EJECT_FAILURES = 3  # Consecutive failures that eject an endpoint
+LLM_EJECT_SECONDS = 30  # Ejected endpoints get one trial request afterwards
+LLM_EXPLORE_RATE = (
+    0.05  # Requests sent to a random healthy endpoint to refresh its stats
+)
+
+
+class LlmTimeoutError(Exception):
+    """Raised when a generation misses its first-token or total deadline."""
+
+    pass
+
+
+class LlmEndpoint:
+    """One model behind one API base and key, with a concurrency cap."""
+
+    def __init__(
+        self,
+        name: str,
+        config: LlmConfig,
+        http_client: httpx.AsyncClient,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+    ):
+        """Initialize the endpoint.
+
+        Args:
+            name: Name reported in stats
+            config: API base, key and model of the endpoint
+            http_client: Shared HTTP client the endpoint sends requests with
+            max_concurrency: Maximum number of concurrent generations
+        """
+        self.name = name
+        self.model_name = config.model_name
+        self.max_concurrency = max_concurrency
+        self.client = AsyncOpenAI(
+            api_key=config.api_key,
+            base_url=config.api_base,
+            http_client=http_client,
+            max_retries=LLM_MAX_RETRIES,
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.ttft: Optional[float] = None  # Moving average time to first token
+        self.error_rate = 0.0  # Moving average of failed requests
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def score(self) -> float:
+        """Expected time to first token, lower is better.
+
+        A failed request costs up to the first-token deadline before it fails
+        over, so failures are weighted with it. Endpoints without samples
+        score 0 so that they are tried first.
+        """
+        load = 1 + self.in_flight / self.max_concurrency
+        return (self.ttft or 0) * load + self.error_rate * LLM_FIRST_TOKEN_TIMEOUT
+
+    def record_ttft(self, seconds: float) -> None:
+        if self.ttft is None:
+            self.ttft = seconds
+        else:
+            self.ttft += LLM_EWMA_ALPHA * (seconds - self.ttft)
+
+    def _record_success(self, ttft: float) -> None:
+        self.record_ttft(ttft)
+        self.error_rate -= LLM_EWMA_ALPHA * self.error_rate
+        self.consecutive_failures = 0
+
+    def _record_failure(self) -> None:
+        self.error_rate += LLM_EWMA_ALPHA * (1 - self.error_rate)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= LLM_EJECT_FAILURES:
+            self.ejected_until = time.monotonic() + LLM_EJECT_SECONDS
+            metrics.incr("llm.endpoint.ejected")
+            logger.warning(
+                f"LLM {self.name} ejected for {LLM_EJECT_SECONDS}s after "
+                f"{self.consecutive_failures} consecutive failures"
+            )
+
+    async def stream(self, messages, **params) -> AsyncIterator[Any]:
+        """Stream the chunks of a chat completion.
+
+        Waits for a free slot of the endpoint first. The upstream stream is
+        closed when the caller stops iterating, fails or misses a deadline.
+
+        Args:
+            messages: Chat messages
+            params: Extra parameters of the completion request
+
+        Yields:
+            The ChatCompletionChunk objects of the stream
+
+        Raises:
+            LlmTimeoutError: If the first-token or total deadline passes
+        """
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        self.requests += 1
+        started = time.monotonic()
+        completion = None
+        first = True
+        try:
+            completion = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model=self.model_name, messages=messages, stream=True, **params
+                ),
+                LLM_FIRST_TOKEN_TIMEOUT,
+            )
+            chunks = completion.__aiter__()
+            while True:
+                remaining = LLM_TOTAL_TIMEOUT - (time.monotonic() - started)
+                if first:
+                    remaining = min(
+                        remaining,
+                        LLM_FIRST_TOKEN_TIMEOUT - (time.monotonic() - started),
+                    )
+                try:
+                    chunk = await asyncio.wait_for(
+                        chunks.__anext__(), max(remaining, 0)
+                    )
+                except StopAsyncIteration:
+                    break
+                if first:
+                    first = False
+                    self._record_success(time.monotonic() - started)
+                yield chunk
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._record_failure()
+            deadline = "first-token" if first else "total"
+            logger.warning(f"LLM {self.name} missed its {deadline} deadline")
+            raise LlmTimeoutError(f"LLM {self.name} missed its {deadline} deadline")
+        except Exception:
+            self.errors += 1
+            self._record_failure()
+            raise
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            # Closing the stream stops the generation if the consumer goes away
+            if completion is not None:
+                await completion.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "ttft_ms": None if self.ttft is None else round(self.ttft * 1000),
+            "error_rate": round(self.error_rate, 3),
+            "healthy": self.healthy,
+        }
+
+
+class LlmPool:
+    """Routes the generations of one role across its endpoints.
+
+    Each request goes to the endpoint with the lowest expected time to first
+    token, skipping ejected endpoints. Requests failing before their first
+    token are retried on the next endpoint. If hedge_after is set, a request
+    without a first token after that many seconds is also sent to another
+    endpoint and whichever answers first is kept.
+    """
+
+    def __init__(self, role: str, endpoints: List[LlmEndpoint], hedge_after: float = 0):
+        self.role = role
+        self.endpoints = endpoints
+        self.hedge_after = hedge_after
+
+    def pick(self, exclude: List[LlmEndpoint] = ()) -> Optional[LlmEndpoint]:
+        """Get the best endpoint not in exclude, preferring healthy ones."""
+        candidates = [e for e in self.endpoints if e not in exclude]
+        if not candidates:
+            return None
+        healthy = [e for e in candidates if e.healthy]
+        if healthy:
+            if len(healthy) > 1 and random.random() < LLM_EXPLORE_RATE:
+                return random.choice(healthy)
+            return min(healthy, key=lambda e: e.score())
+        # All remaining endpoints are ejected, try the one recovering first
+        return min(candidates, key=lambda e: e.ejected_until)
+
+    async def stream(self, messages, **params) -> AsyncIterator[Any]:
+        """Stream the chunks of a chat completion from the best endpoint.
+
+        Args:
+            messages: Chat messages
+            params: Extra parameters of the completion request
+
+        Yields:
+            The ChatCompletionChunk objects of the stream
+        """
+        tried: List[LlmEndpoint] = []
+        # Pending first chunk of every attempt: task -> (endpoint, stream, start)
+        attempts: Dict[asyncio.Future, Tuple[LlmEndpoint, Any, float]] = {}
+
+        def start() -> bool:
+            endpoint = self.pick(tried)
+            if endpoint is None:
+                return False
+            tried.append(endpoint)
+            stream = endpoint.stream(messages, **params)
+            task = asyncio.ensure_future(stream.__anext__())
+            attempts[task] = (endpoint, stream, time.monotonic())
+            return True
+
+        start()
+        winner = None
+        first_chunk = None
+        error: Optional[BaseException] = None
+        try:
+            while winner is None:
+                # Hedge one attempt at a time while untried endpoints remain
+                can_hedge = (
+                    self.hedge_after
+                    and len(attempts) == 1
+                    and len(tried) < len(self.endpoints)
+                )
+                done, _ = await asyncio.wait(
+                    attempts,
+                    timeout=self.hedge_after if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    start()
+                    metrics.incr("llm.generation.hedged")
+                    continue
+
+                for task in done:
+                    endpoint, stream, _ = attempts.pop(task)
+                    try:
+                        first_chunk = task.result()
+                    except StopAsyncIteration:
+                        pass
+                    except Exception as e:
+                        error = e
+                        continue
+                    winner = stream
+                    break
+
+                # Fail over to the next endpoint once every attempt failed
+                if winner is None and not attempts:
+                    if not start():
+                        raise error
+                    metrics.incr("llm.generation.failover")
+                    logger.warning(f"LLM {endpoint.name} failed, failing over: {error}")
+        finally:
+            # Stop the attempts that lost, they took at least this long
+            for task, (endpoint, _, started) in attempts.items():
+                if not task.done():
+                    task.cancel()
+                    endpoint.record_ttft(time.monotonic() - started)
+            if attempts:
+                await asyncio.wait(attempts)
+            for task, (_, stream, _) in attempts.items():
+                if not task.cancelled():
+                    task.exception()  # Retrieved, so it is not reported unhandled
+                await stream.aclose()
+
+        try:
+            if first_chunk is not None:
+                yield first_chunk
+                async for chunk in winner:
+                    yield chunk
+        finally:
+            await winner.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "endpoints": [endpoint.name for endpoint in self.endpoints],
+            "hedge_after_ms": round(self.hedge_after * 1000),
+        }
+
+
+class LlmClientRegistry:
+    """Shares one HTTP connection pool and one endpoint per configuration.
+
+    Services look up the endpoint pool of their role; roles configured with
+    the same API base, key and model share the endpoint, its concurrency cap
+    and its latency statistics.
+    """
+
+    def __init__(self):
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._endpoints: Dict[Tuple[str, str, str], LlmEndpoint] = {}
+        self._pools: Dict[str, LlmPool] = {}
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(
+                    LLM_TOTAL_TIMEOUT,
+                    connect=LLM_CONNECT_TIMEOUT,
+                    read=LLM_READ_TIMEOUT,
+                ),
+            )
+        return self._http_client
+
+    def _get_endpoint(self, config: LlmConfig) -> LlmEndpoint:
+        key = (config.api_base, config.api_key, config.model_name)
+        endpoint = self._endpoints.get(key)
+        if endpoint is None:
+            host = urlparse(config.api_base).netloc
+            name = f"{config.model_name}@{host}#{len(self._endpoints)}"
+            endpoint = LlmEndpoint(name, config, self.http_client)
+            self._endpoints[key] = endpoint
+        return endpoint
+
+    def get(self, role: str) -> LlmPool:
+        """Get the endpoint pool of a role, e.g. "summary" for app_config.llm_summary."""
+        pool = self._pools.get(role)
+        if pool is None:
+            config: LlmConfig = getattr(app_config, f"llm_{role}")
+            endpoints = []
+            for endpoint_config in [config] + config.pool:
+                endpoint = self._get_endpoint(endpoint_config)
+                if endpoint not in endpoints:
+                    endpoints.append(endpoint)
+            pool = LlmPool(role, endpoints, app_config.llm_hedge_after_ms / 1000)
+            self._pools[role] = pool
+        return pool
+
+    def _pool_stats(self) -> Dict[str, Any]:
+        # httpx does not expose pool usage publicly, read it from httpcore
+        try:
+            connections = self.http_client._transport._pool.connections
+        except AttributeError:
+            return {}
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            "connections": len(connections),
+            "idle": idle,
+            "active": len(connections) - idle,
+            "max_connections": LLM_MAX_CONNECTIONS,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pool": self._pool_stats(),
+            "roles": {role: pool.stats() for role, pool in self._pools.items()},
+            "endpoints": {
+                endpoint.name: endpoint.stats() for endpoint in self._endpoints.values()
+            },
+        }
+
+    async def close(self) -> None:
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+            self._endpoints.clear()
+            self._pools.clear()
+
+
+# Create a singleton instance
+llm_clients = LlmClientRegistry()
+metrics.register("llm.clients", llm_clients.stats)
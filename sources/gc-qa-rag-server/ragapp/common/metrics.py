@@ -0,0 +1,59 @@
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict
+
+
+class Metrics:
+    """In-process registry of counters and pull-based collectors.
+
+    Counters are incremented on the hot path; collectors are callables that
+    report the current state of a component (cache sizes, queue depths...)
+    and are only evaluated when a snapshot is taken.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        """Increment a counter.
+
+        Args:
+            name: Dotted counter name, e.g. "llm.aborted.chat"
+            value: Amount to add
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def register(self, name: str, collector: Callable[[], Dict[str, Any]]) -> None:
+        """Register a collector reported under the given name.
+
+        Args:
+            name: Name of the component
+            collector: Callable returning the component's current stats
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get the current value of every counter and collector.
+
+        Returns:
+            Dict[str, Any]: {"counters": {...}, "<collector name>": {...}}
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            collectors = dict(self._collectors)
+
+        result: Dict[str, Any] = {"counters": counters}
+        for name, collector in collectors.items():
+            try:
+                result[name] = collector()
+            except Exception as e:
+                result[name] = {"error": str(e)}
+        return result
+
+
+# Create a singleton instance
+metrics = Metrics()
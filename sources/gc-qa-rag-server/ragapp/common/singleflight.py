@@ -0,0 +1,165 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from ragapp.common.metrics import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one in-flight call.
+
+    The first caller starts the work as a task; callers arriving while it is
+    running await the same task. The work is shielded, so a caller that goes
+    away does not cancel it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn, or join the in-flight call with the same key.
+
+        Args:
+            key: Identity of the call
+            fn: Zero-argument coroutine function doing the work
+
+        Returns:
+            The result of the (possibly shared) call
+        """
+        task = self._calls.get(key)
+        if task is None:
+            metrics.incr(f"singleflight.{self.name}.leader")
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            metrics.incr(f"singleflight.{self.name}.shared")
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._calls)}
+
+
+class _Broadcast:
+    """One upstream stream replayed to any number of subscribers."""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class StreamBroadcaster:
+    """Shares one upstream text stream between identical concurrent requests.
+
+    The first subscriber starts the upstream stream; later subscribers with
+    the same key receive every chunk produced so far followed by the live
+    chunks. The upstream stream is cancelled once all subscribers are gone.
+
+    A subscriber only joins when its iterator is first advanced, so an
+    iterator dropped before it is consumed neither starts nor holds open an
+    upstream stream.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._streams: Dict[str, _Broadcast] = {}
+
+    async def subscribe(
+        self, key: str, chat_method: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> AsyncIterator[Any]:
+        """Get a stream of the chunks produced by chat_method for key.
+
+        Args:
+            key: Identity of the stream
+            chat_method: Async function returning the upstream async iterator
+            args: Positional arguments passed to chat_method
+            kwargs: Keyword arguments passed to chat_method
+
+        Returns:
+            An async iterator over the broadcast chunks
+        """
+        return self._consume(key, chat_method, *args, **kwargs)
+
+    def _join(self, key, chat_method, *args, **kwargs) -> _Broadcast:
+        broadcast = self._streams.get(key)
+        # A stopping stream would end early for a new subscriber
+        if broadcast is None or broadcast.task.done() or broadcast.task.cancelling():
+            metrics.incr(f"broadcast.{self.name}.leader")
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(
+                self._produce(key, broadcast, chat_method, *args, **kwargs)
+            )
+        else:
+            metrics.incr(f"broadcast.{self.name}.shared")
+
+        broadcast.subscribers += 1
+        return broadcast
+
+    async def _produce(self, key, broadcast: _Broadcast, chat_method, *args, **kwargs):
+        try:
+            result_gen = await chat_method(*args, **kwargs)
+            async for chunk in result_gen:
+                async with broadcast.changed:
+                    broadcast.chunks.append(chunk)
+                    broadcast.changed.notify_all()
+        except BaseException as e:
+            broadcast.error = e
+            if not isinstance(e, asyncio.CancelledError):
+                logger.error(f"Broadcast stream {self.name} failed: {e}")
+        finally:
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+            async with broadcast.changed:
+                broadcast.done = True
+                broadcast.changed.notify_all()
+
+    async def _consume(self, key, chat_method, *args, **kwargs) -> AsyncIterator[Any]:
+        # Joined in the generator body, so the finally below always leaves
+        broadcast = self._join(key, chat_method, *args, **kwargs)
+        index = 0
+        try:
+            while True:
+                async with broadcast.changed:
+                    await broadcast.changed.wait_for(
+                        lambda: index < len(broadcast.chunks) or broadcast.done
+                    )
+                    chunks = broadcast.chunks[index:]
+                    done = broadcast.done
+
+                for chunk in chunks:
+                    yield chunk
+                index += len(chunks)
+
+                if done and index >= len(broadcast.chunks):
+                    if broadcast.error is not None and not isinstance(
+                        broadcast.error, asyncio.CancelledError
+                    ):
+                        raise broadcast.error
+                    return
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done:
+                metrics.incr(f"broadcast.{self.name}.cancelled")
+                # Identical requests arriving from now on start a new stream
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+                broadcast.task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams": len(self._streams),
+            "subscribers": sum(b.subscribers for b in self._streams.values()),
+        }
@@ -1,31 +1,73 @@
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException, Response
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import BackgroundTasks
-from qdrant_client import QdrantClient
+from starlette.background import BackgroundTask
+from qdrant_client import AsyncQdrantClient
+import asyncio
+import csv
+import hmac
+import io
+import json
 import logging
 import time
+from datetime import timedelta
 from typing import Dict, Any, Optional
 import requests
 
 from ragapp.common.config import app_config
-from ragapp.common.db import db
+from ragapp.common.embedding import EmbeddingError
+from ragapp.common.db import (
+    db,
+    parse_date,
+    encode_history_cursor,
+    decode_history_cursor,
+)
 from ragapp.common.log import setup_logging
-from ragapp.services.search import search_sementic_hybrid
-from ragapp.services.query import chat_for_query
+from ragapp.services.search import (
+    search_sementic_hybrid_async,
+    get_query_similarity_async,
+)
+from ragapp.services.query import get_cached_rewrite, rewrite_query
 from ragapp.services.summary import summary_hits
 from ragapp.services.think import summary_hits_think
 from ragapp.services.research import research_hits
 from ragapp.services.product import get_available_products
-from ragapp.common.limiter import rate_limiter
-from ragapp.common.llm import get_llm_sse_result, get_llm_full_result
+from ragapp.services.collection import collection_aliases
+from ragapp.services.router import category_router
+from ragapp.services.retrieval import save_retrieval, load_retrieval
+from ragapp.services.session import (
+    load_session,
+    new_session_id,
+    resolve_conversation,
+    build_prompt_messages,
+    get_session_hits,
+    record_turn,
+)
+from ragapp.services.analytics import rollup_scheduler, get_daily_rollups
+from ragapp.common.limiter import rate_limiter, get_client_key
+from ragapp.common.admission import admission
+from ragapp.common.metrics import metrics
+from ragapp.common.cache import make_cache_key, normalize_text
+from ragapp.common.singleflight import StreamBroadcaster
+from ragapp.common.context import build_sources
+from ragapp.common.llm_client import llm_clients
+from ragapp.common.llm import (
+    SSEEvent,
+    get_llm_sse_result,
+    stream_events,
+)
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
 # Product cache configuration
 PRODUCTS_CACHE_TTL = 10  # Cache for 10 seconds
+
+# Speculative hits are used when the rewritten query is at least this similar
+SPECULATIVE_SIMILARITY = 0.9
 _products_cache: Dict[
     str, Dict[str, Any]
 ] = {}  # {mode: {data: result, timestamp: time}}
@@ -44,6 +86,11 @@ class ChatModel(BaseModel):
     messages: list
     product: str = "forguncy"
     extra_instruction: str = ""
+    retrieval_id: str = ""
+    # Id from X-Session-Id, or any value to start a session; known sessions may
+    # send only the new message
+    session_id: str = ""
+    stream_events: bool = False  # Send typed sources/timing/heartbeat events
 
 
 class FeedbackModel(BaseModel):
@@ -57,13 +104,52 @@ class FeedbackModel(BaseModel):
 class SearchHistoryRequest(BaseModel):
     date: str
     token: str
+    end_date: str = ""  # Last day included, defaults to date
+    product: str = ""
+    mode: str = ""
+    session_id: str = ""
+    cursor: str = ""
+    limit: int = 1000
+    format: str = "ndjson"  # Export format, ndjson or csv
+
+
+class AnalyticsRequest(BaseModel):
+    date: str
+    token: str
+    end_date: str = ""  # Last day included, defaults to date
+    product: str = ""
 
 
+# Identical first-turn answers can share one upstream LLM stream
+answer_streams = StreamBroadcaster("answer")
+metrics.register("broadcast.answer", answer_streams.stats)
+
 # Initialize log
 setup_logging()
 
+# Initialize vector database
+url = app_config.vector_db.host
+async_client = AsyncQdrantClient(url)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    collection_aliases.start(async_client)
+    if app_config.category_router:
+        category_router.start(async_client)
+    rollup_scheduler.start()
+    yield
+    await collection_aliases.stop()
+    await category_router.stop()
+    await llm_clients.close()
+    # Both block until their worker threads finish, so keep them off the loop
+    await asyncio.to_thread(rollup_scheduler.stop)
+    # Write the buffered history and feedback rows before exiting
+    await asyncio.to_thread(db.close)
+
+
 # Initialize app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -71,20 +157,168 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "X-Retrieval-Id",
+        "X-Session-Id",
+        "X-RateLimit-Limit",
+        "X-RateLimit-Remaining",
+        "X-RateLimit-Reset",
+        "Retry-After",
+    ],
 )
 
-# Initialize vector database
-url = app_config.vector_db.host
-client = QdrantClient(url)
-
 
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
 
 
+async def _answer_stream(
+    mode: str,
+    keyword: str,
+    item: ChatModel,
+    conversation: list,
+    hits: list,
+    started: float,
+    session_id: str,
+    client: str,
+    chat_method,
+    *args,
+):
+    """Get the SSE stream of an answer, shared between identical first turns"""
+    source = (chat_method, *args)
+    if app_config.coalesce_answers and len(conversation) == 1:
+        key = make_cache_key(
+            mode,
+            normalize_text(keyword),
+            item.product,
+            item.extra_instruction,
+            item.stream_events,
+        )
+        source = (answer_streams.subscribe, key, chat_method, *args)
+
+    if session_id:
+        source = (
+            record_turn,
+            session_id,
+            client,
+            mode,
+            conversation,
+            keyword,
+            hits,
+            *source,
+        )
+
+    if item.stream_events:
+        prelude = [
+            SSEEvent("sources", build_sources(hits)),
+            SSEEvent(
+                "timing",
+                {"retrieval_ms": round((time.monotonic() - started) * 1000)},
+            ),
+        ]
+        return await get_llm_sse_result(stream_events, prelude, *source)
+
+    return await get_llm_sse_result(*source)
+
+
+async def _open_session(item: ChatModel, client: str):
+    """Get the session of a request and the id its turn is stored under.
+
+    Unknown ids and ids of other clients start a new session under a newly
+    issued id, so that clients cannot choose or take over session ids.
+    """
+    if not item.session_id:
+        return None, ""
+    session = await load_session(item.session_id, client)
+    return session, item.session_id if session else new_session_id()
+
+
+def _session_headers(limit_headers: Dict[str, str], session_id: str):
+    if not session_id:
+        return limit_headers
+    return {**limit_headers, "X-Session-Id": session_id}
+
+
+async def _rewrite_and_search(
+    messages: list, product: str, session: Optional[Dict] = None
+):
+    """Rewrite a follow-up question into a standalone query and get its hits.
+
+    Hits of the session's previous turn are reused for the same query. In
+    speculative mode, retrieval on the raw last message runs while the query
+    is rewritten; its hits are used if the rewrite means the same, and only
+    otherwise is the rewritten query searched.
+    """
+    keyword = await get_cached_rewrite(messages)
+    if keyword is not None or not app_config.speculative_retrieval:
+        if keyword is None:
+            keyword = await rewrite_query(messages, lookup_cache=False)
+        hits = get_session_hits(session, keyword)
+        if hits is None:
+            hits = await search_sementic_hybrid_async(async_client, keyword, product)
+        return keyword, hits
+
+    raw_query = messages[-1]["content"]
+    speculative = asyncio.ensure_future(
+        search_sementic_hybrid_async(async_client, raw_query, product)
+    )
+    try:
+        keyword = await rewrite_query(messages, lookup_cache=False)
+        hits = get_session_hits(session, keyword)
+        if hits is not None:
+            speculative.cancel()
+            return keyword, hits
+        similarity = await get_query_similarity_async(raw_query, keyword)
+    except EmbeddingError as e:
+        logger.error(f"Error comparing rewritten query: {e}")
+        similarity = 0.0
+    except BaseException:
+        speculative.cancel()
+        raise
+
+    if similarity >= SPECULATIVE_SIMILARITY:
+        metrics.incr("speculative_retrieval.hit")
+        return keyword, await speculative
+
+    metrics.incr("speculative_retrieval.miss")
+    speculative.cancel()
+    hits = await search_sementic_hybrid_async(async_client, keyword, product)
+    return keyword, hits
+
+
+def _sse_response(stream, on_close=None, headers=None) -> StreamingResponse:
+    """Stream SSE frames, stopping the generation if the client disconnects"""
+
+    # Starlette cancels the response on disconnect and then runs the background
+    # task, so closing the stream there reliably reaches the upstream model
+    async def close_stream():
+        try:
+            await stream.aclose()
+        finally:
+            if on_close is not None:
+                on_close()
+
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers=headers,
+        background=BackgroundTask(close_stream),
+    )
+
+
+async def _search_hits(keyword: str, product: str, retrieval_id: str = ""):
+    """Get hits for a keyword, reusing a /search/ retrieval when it matches"""
+    hits = await load_retrieval(retrieval_id, keyword, product)
+    if hits is not None:
+        logger.info(f"Reusing retrieval: {retrieval_id}")
+        return hits
+
+    return await search_sementic_hybrid_async(async_client, keyword, product)
+
+
 @app.post("/search/")
-def search(item: SearchModel, background_tasks: BackgroundTasks):
+async def search(item: SearchModel, request: Request, response: Response):
     if item.mode not in ["search", "chat", "think"]:
         raise HTTPException(status_code=403, detail="mode should be search or chat")
 
@@ -98,10 +332,9 @@ def search(item: SearchModel, background_tasks: BackgroundTasks):
             status_code=403, detail="product should be less than 100 characters"
         )
 
-    rate_limiter.hit_search()
+    response.headers.update(await rate_limiter.hit("search", get_client_key(request)))
 
-    background_tasks.add_task(
-        db.add_search_history,
+    db.add_search_history(
         item.keyword,
         item.mode,
         item.product,
@@ -109,13 +342,16 @@ def search(item: SearchModel, background_tasks: BackgroundTasks):
         item.session_index,
     )
 
-    hits = search_sementic_hybrid(client, item.keyword, item.product)
+    hits = await search_sementic_hybrid_async(async_client, item.keyword, item.product)
+    response.headers["X-Retrieval-Id"] = await save_retrieval(
+        item.keyword, item.product, hits
+    )
 
     return hits
 
 
 @app.post("/chat_streaming/")
-async def chat_streaming(item: ChatModel):
+async def chat_streaming(item: ChatModel, request: Request):
     if len(item.keyword) > 1000:
         raise HTTPException(
             status_code=403, detail="keyword should be less than 1000 characters"
@@ -126,25 +362,63 @@ async def chat_streaming(item: ChatModel):
             status_code=403, detail="product should be less than 100 characters"
         )
 
-    rate_limiter.hit_chat()
-
-    if len(item.messages) == 1:
-        keyword = item.messages[0]["content"]
-    elif len(item.messages) >= 7:
-        stream = await getLimitText()
-        return StreamingResponse(stream, media_type="text/event-stream")
-    else:
-        keyword = await get_llm_full_result(chat_for_query, item.messages)
+    if len(item.retrieval_id) > 64:
+        raise HTTPException(
+            status_code=403, detail="retrieval_id should be less than 64 characters"
+        )
 
-    logger.info(f"Keyword: {keyword}")
+    if len(item.session_id) > 100:
+        raise HTTPException(
+            status_code=403, detail="session_id should be less than 100 characters"
+        )
 
-    hits = search_sementic_hybrid(client, keyword, item.product)
-    stream = await get_llm_sse_result(summary_hits, keyword, item.messages, hits, item.extra_instruction)
-    return StreamingResponse(stream, media_type="text/event-stream")
+    client = get_client_key(request)
+    limit_headers = await rate_limiter.hit("chat", client)
+    ticket = await admission.acquire("chat", client)
+    try:
+        started = time.monotonic()
+
+        session, session_id = await _open_session(item, client)
+        headers = _session_headers(limit_headers, session_id)
+        conversation = resolve_conversation(session, item.messages)
+        messages = build_prompt_messages(session, conversation)
+
+        if len(conversation) == 1:
+            keyword = conversation[0]["content"]
+            hits = await _search_hits(keyword, item.product, item.retrieval_id)
+        elif len(conversation) >= 7:
+            ticket.release()
+            stream = await getLimitText()
+            return StreamingResponse(
+                stream, media_type="text/event-stream", headers=headers
+            )
+        else:
+            keyword, hits = await _rewrite_and_search(messages, item.product, session)
+
+        logger.info(f"Keyword: {keyword}")
+        stream = await _answer_stream(
+            "chat",
+            keyword,
+            item,
+            conversation,
+            hits,
+            started,
+            session_id,
+            client,
+            summary_hits,
+            keyword,
+            messages,
+            hits,
+            item.extra_instruction,
+        )
+    except BaseException:
+        ticket.release()
+        raise
+    return _sse_response(stream, ticket.release, headers)
 
 
 @app.post("/think_streaming/")
-async def think_streaming(item: ChatModel):
+async def think_streaming(item: ChatModel, request: Request):
     if len(item.keyword) > 1000:
         raise HTTPException(
             status_code=403, detail="keyword should be less than 1000 characters"
@@ -155,25 +429,63 @@ async def think_streaming(item: ChatModel):
             status_code=403, detail="product should be less than 100 characters"
         )
 
-    rate_limiter.hit_think()
-
-    if len(item.messages) == 1:
-        keyword = item.messages[0]["content"]
-    elif len(item.messages) >= 7:
-        stream = await getLimitText()
-        return StreamingResponse(stream, media_type="text/event-stream")
-    else:
-        keyword = await get_llm_full_result(chat_for_query, item.messages)
+    if len(item.retrieval_id) > 64:
+        raise HTTPException(
+            status_code=403, detail="retrieval_id should be less than 64 characters"
+        )
 
-    logger.info(f"Keyword: {keyword}")
+    if len(item.session_id) > 100:
+        raise HTTPException(
+            status_code=403, detail="session_id should be less than 100 characters"
+        )
 
-    hits = search_sementic_hybrid(client, keyword, item.product)
-    stream = await get_llm_sse_result(summary_hits_think, keyword, item.messages, hits, item.extra_instruction)
-    return StreamingResponse(stream, media_type="text/event-stream")
+    client = get_client_key(request)
+    limit_headers = await rate_limiter.hit("think", client)
+    ticket = await admission.acquire("think", client)
+    try:
+        started = time.monotonic()
+
+        session, session_id = await _open_session(item, client)
+        headers = _session_headers(limit_headers, session_id)
+        conversation = resolve_conversation(session, item.messages)
+        messages = build_prompt_messages(session, conversation)
+
+        if len(conversation) == 1:
+            keyword = conversation[0]["content"]
+            hits = await _search_hits(keyword, item.product, item.retrieval_id)
+        elif len(conversation) >= 7:
+            ticket.release()
+            stream = await getLimitText()
+            return StreamingResponse(
+                stream, media_type="text/event-stream", headers=headers
+            )
+        else:
+            keyword, hits = await _rewrite_and_search(messages, item.product, session)
+
+        logger.info(f"Keyword: {keyword}")
+        stream = await _answer_stream(
+            "think",
+            keyword,
+            item,
+            conversation,
+            hits,
+            started,
+            session_id,
+            client,
+            summary_hits_think,
+            keyword,
+            messages,
+            hits,
+            item.extra_instruction,
+        )
+    except BaseException:
+        ticket.release()
+        raise
+    return _sse_response(stream, ticket.release, headers)
 
 
 @app.post("/reasearch_streaming/")
-async def reasearch_streaming(item: ChatModel):
+async def reasearch_streaming(item: ChatModel, request: Request):
     if len(item.keyword) > 1000:
         raise HTTPException(
             status_code=403, detail="keyword should be less than 1000 characters"
@@ -184,27 +496,66 @@ async def reasearch_streaming(item: ChatModel):
             status_code=403, detail="product should be less than 100 characters"
         )
 
-    rate_limiter.hit_research()
-
-    if len(item.messages) == 1:
-        keyword = item.messages[0]["content"]
-    elif len(item.messages) >= 7:
-        stream = await getLimitText()
-        return StreamingResponse(stream, media_type="text/event-stream")
-    else:
-        keyword = await get_llm_full_result(chat_for_query, item.messages)
+    if len(item.retrieval_id) > 64:
+        raise HTTPException(
+            status_code=403, detail="retrieval_id should be less than 64 characters"
+        )
 
-    logger.info(f"Keyword: {keyword}")
+    if len(item.session_id) > 100:
+        raise HTTPException(
+            status_code=403, detail="session_id should be less than 100 characters"
+        )
 
-    hits = search_sementic_hybrid(client, keyword, item.product)
-    stream = await get_llm_sse_result(
-        research_hits, client, keyword, item.messages, hits, item.product, item.extra_instruction
-    )
-    return StreamingResponse(stream, media_type="text/event-stream")
+    client = get_client_key(request)
+    limit_headers = await rate_limiter.hit("research", client)
+    ticket = await admission.acquire("research", client)
+    try:
+        started = time.monotonic()
+
+        session, session_id = await _open_session(item, client)
+        headers = _session_headers(limit_headers, session_id)
+        conversation = resolve_conversation(session, item.messages)
+        messages = build_prompt_messages(session, conversation)
+
+        if len(conversation) == 1:
+            keyword = conversation[0]["content"]
+            hits = await _search_hits(keyword, item.product, item.retrieval_id)
+        elif len(conversation) >= 7:
+            ticket.release()
+            stream = await getLimitText()
+            return StreamingResponse(
+                stream, media_type="text/event-stream", headers=headers
+            )
+        else:
+            keyword, hits = await _rewrite_and_search(messages, item.product, session)
+
+        logger.info(f"Keyword: {keyword}")
+        stream = await _answer_stream(
+            "research",
+            keyword,
+            item,
+            conversation,
+            hits,
+            started,
+            session_id,
+            client,
+            research_hits,
+            async_client,
+            keyword,
+            messages,
+            hits,
+            item.product,
+            item.extra_instruction,
+            item.stream_events,
+        )
+    except BaseException:
+        ticket.release()
+        raise
+    return _sse_response(stream, ticket.release, headers)
 
 
 @app.post("/feedback/")
-def feedback(item: FeedbackModel, background_tasks: BackgroundTasks):
+async def feedback(item: FeedbackModel, request: Request, response: Response):
     if len(item.question) > 1000:
         raise HTTPException(
             status_code=403, detail="question should be less than 1000 characters"
@@ -225,10 +576,9 @@ def feedback(item: FeedbackModel, background_tasks: BackgroundTasks):
             status_code=403, detail="product should be less than 100 characters"
         )
 
-    rate_limiter.hit_feedback()
+    response.headers.update(await rate_limiter.hit("feedback", get_client_key(request)))
 
-    background_tasks.add_task(
-        db.add_qa_feedback,
+    db.add_qa_feedback(
         item.question,
         item.answer,
         item.rating,
@@ -239,6 +589,120 @@ def feedback(item: FeedbackModel, background_tasks: BackgroundTasks):
     return "success"
 
 
+def _check_admin_token(token: str) -> None:
+    if not app_config.admin_token or not hmac.compare_digest(
+        token.encode("utf-8"), app_config.admin_token.encode("utf-8")
+    ):
+        raise HTTPException(status_code=403, detail="invalid token")
+
+
+def _get_history_range(item):
+    try:
+        start = parse_date(item.date)
+        end = parse_date(item.end_date) if item.end_date else start
+    except ValueError:
+        raise HTTPException(
+            status_code=403, detail="date should be in format YYYY-MM-DD"
+        )
+    return start, end + timedelta(days=1)
+
+
+def _history_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    # Session ids identify the sessions of users and are not exported
+    row = {key: value for key, value in record.items() if key != "session_id"}
+    row["create_time"] = record["create_time"].isoformat()
+    return row
+
+
+@app.post("/search_history/")
+def search_history(item: SearchHistoryRequest):
+    """Get one page of search history, continue with the returned next_cursor"""
+    _check_admin_token(item.token)
+    start, end = _get_history_range(item)
+
+    try:
+        after = decode_history_cursor(item.cursor) if item.cursor else None
+    except ValueError:
+        raise HTTPException(status_code=403, detail="invalid cursor")
+
+    limit = min(max(1, item.limit), db.HISTORY_MAX_PAGE_SIZE)
+    records = db.get_search_history_page(
+        start, end, item.product, item.mode, item.session_id, after, limit
+    )
+
+    next_cursor = ""
+    if len(records) >= limit:
+        next_cursor = encode_history_cursor(records[-1])
+
+    return {
+        "items": [_history_row(r) for r in records],
+        "next_cursor": next_cursor,
+    }
+
+
+@app.post("/search_history/export/")
+def export_search_history(item: SearchHistoryRequest):
+    """Stream the whole search history of a date range as NDJSON or CSV"""
+    _check_admin_token(item.token)
+    start, end = _get_history_range(item)
+
+    if item.format not in ["ndjson", "csv"]:
+        raise HTTPException(status_code=403, detail="format should be ndjson or csv")
+
+    records = db.iter_search_history(
+        start, end, item.product, item.mode, item.session_id
+    )
+
+    if item.format == "csv":
+        fields = [
+            "id",
+            "query",
+            "mode",
+            "product",
+            "session_index",
+            "create_time",
+        ]
+
+        def stream():
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=fields)
+            writer.writeheader()
+            for record in records:
+                writer.writerow(_history_row(record))
+                if buffer.tell() >= 64 * 1024:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+
+        return StreamingResponse(stream(), media_type="text/csv")
+
+    def stream():
+        lines = []
+        size = 0
+        for record in records:
+            line = json.dumps(_history_row(record), ensure_ascii=False) + "\n"
+            lines.append(line)
+            size += len(line)
+            if size >= 64 * 1024:
+                yield "".join(lines)
+                lines = []
+                size = 0
+        yield "".join(lines)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post("/analytics/daily/")
+def analytics_daily(item: AnalyticsRequest):
+    """Get the pre-aggregated daily query and feedback rollups of a date range"""
+    _check_admin_token(item.token)
+    start, end = _get_history_range(item)
+    return get_daily_rollups(
+        start.date(), (end - timedelta(days=1)).date(), item.product
+    )
+
+
 async def getLimitText():
     return "Maximum conversation rounds reached, please start a new conversation."
 
@@ -317,6 +781,13 @@ def get_products(mode: str = "fixed", background_tasks: BackgroundTasks = None):
     return result
 
 
+@app.get("/metrics/")
+def get_metrics(token: str = Header("", alias="X-Admin-Token")):
+    """Get in-process counters and cache statistics of this worker"""
+    _check_admin_token(token)
+    return metrics.snapshot()
+
+
 @app.get("/api/raw_file/{product}/{filename:path}")
 def proxy_raw_file(product: str, filename: str):
     etl_url = f"{app_config.etl_base_url}/api/raw_file/{product}/{filename}"
@@ -0,0 +1,314 @@
+import hashlib
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import Session
+
+from ragapp.common.cache import normalize_text
+from ragapp.common.db import (
+    db,
+    SearchHistory,
+    QAFeedback,
+    QueryDailyRollup,
+    TopQueryDailyRollup,
+    SessionDepthDailyRollup,
+    FeedbackDailyRollup,
+    RollupWatermark,
+)
+from ragapp.common.metrics import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Rollup job configuration
+ROLLUP_INTERVAL = 5 * 60  # Run every 5 minutes
+ROLLUP_BATCH_SIZE = 5000  # Raw rows folded per transaction
+ROLLUP_SETTLE_SECONDS = 60  # Rows younger than this may still be in flight
+ROLLUP_KEY_CHUNK = 500  # Keys per IN query when merging counts
+TOP_QUERIES_LIMIT = 20
+
+
+def _query_hash(query: str) -> str:
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+def _merge_counts(
+    session: Session,
+    model,
+    key_columns: List[str],
+    counts: Dict[Tuple, Dict[str, int]],
+    extra_values: Optional[Dict[Tuple, Dict[str, Any]]] = None,
+) -> None:
+    """Add aggregated counts to rollup rows, creating missing rows.
+
+    Args:
+        session: Session of the rollup transaction
+        model: Rollup model class
+        key_columns: Names of the primary key columns
+        counts: {key tuple: {count column: increment}}
+        extra_values: {key tuple: {column: value}} set on newly created rows
+    """
+    keys = list(counts.keys())
+    columns = [getattr(model, name) for name in key_columns]
+
+    existing = {}
+    for i in range(0, len(keys), ROLLUP_KEY_CHUNK):
+        chunk = keys[i : i + ROLLUP_KEY_CHUNK]
+        for row in session.query(model).filter(tuple_(*columns).in_(chunk)):
+            existing[tuple(getattr(row, name) for name in key_columns)] = row
+
+    for key, increments in counts.items():
+        row = existing.get(key)
+        if row is None:
+            values = dict(zip(key_columns, key))
+            values.update((extra_values or {}).get(key, {}))
+            values.update(increments)
+            session.add(model(**values))
+        else:
+            for name, value in increments.items():
+                setattr(row, name, getattr(row, name) + value)
+
+
+def _get_watermark(session: Session, name: str) -> RollupWatermark:
+    # Row lock serializes the job across workers sharing the database
+    watermark = (
+        session.query(RollupWatermark)
+        .filter(RollupWatermark.name == name)
+        .with_for_update()
+        .one_or_none()
+    )
+    if watermark is None:
+        watermark = RollupWatermark(name=name, last_id=0)
+        session.add(watermark)
+        session.flush()
+    return watermark
+
+
+def _get_settled_rows(session: Session, model, last_id: int) -> List:
+    """Get the next batch of rows that can no longer be overtaken by inserts.
+
+    Rows are buffered before insertion, so ids are not strictly ordered by
+    insert_time across workers. Only rows below the lowest id inserted in the
+    settle window are read, so a late insert can never fall behind the
+    watermark. Rows written before insert_time existed have it unset and
+    count as settled.
+    """
+    cutoff = datetime.now() - timedelta(seconds=ROLLUP_SETTLE_SECONDS)
+    first_recent_id = (
+        session.query(func.min(model.id))
+        .filter(model.id > last_id, model.insert_time >= cutoff)
+        .scalar()
+    )
+
+    query = session.query(model).filter(model.id > last_id)
+    if first_recent_id is not None:
+        query = query.filter(model.id < first_recent_id)
+    return query.order_by(model.id).limit(ROLLUP_BATCH_SIZE).all()
+
+
+def _fold_search_history(session: Session, rows: List[SearchHistory]) -> None:
+    queries: Dict[Tuple, Dict[str, int]] = {}
+    top_queries: Dict[Tuple, Dict[str, int]] = {}
+    top_query_texts: Dict[Tuple, Dict[str, Any]] = {}
+    depths: Dict[Tuple, Dict[str, int]] = {}
+
+    for row in rows:
+        day = row.create_time.date()
+        product = row.product or ""
+        session_index = row.session_index or 0
+
+        counts = queries.setdefault(
+            (day, product, row.mode or ""), {"query_count": 0, "session_count": 0}
+        )
+        counts["query_count"] += 1
+        # Every session has exactly one turn with index 0
+        if session_index == 0:
+            counts["session_count"] += 1
+
+        # A session reaches depth n when its turn with index n - 1 is recorded
+        depth_counts = depths.setdefault(
+            (day, product, session_index + 1), {"session_count": 0}
+        )
+        depth_counts["session_count"] += 1
+
+        query = normalize_text(row.query).casefold()
+        key = (day, product, _query_hash(query))
+        top_queries.setdefault(key, {"count": 0})["count"] += 1
+        top_query_texts[key] = {"query": query}
+
+    _merge_counts(session, QueryDailyRollup, ["day", "product", "mode"], queries)
+    _merge_counts(
+        session,
+        TopQueryDailyRollup,
+        ["day", "product", "query_hash"],
+        top_queries,
+        top_query_texts,
+    )
+    _merge_counts(session, SessionDepthDailyRollup, ["day", "product", "depth"], depths)
+
+
+def _fold_feedback(session: Session, rows: List[QAFeedback]) -> None:
+    ratings: Dict[Tuple, Dict[str, int]] = {}
+    for row in rows:
+        key = (row.create_time.date(), row.product or "", row.rating or 0)
+        ratings.setdefault(key, {"count": 0})["count"] += 1
+
+    _merge_counts(session, FeedbackDailyRollup, ["day", "product", "rating"], ratings)
+
+
+def _run_source(name: str, model, fold) -> int:
+    total = 0
+    while True:
+        with db.get_session() as session:
+            watermark = _get_watermark(session, name)
+            rows = _get_settled_rows(session, model, watermark.last_id)
+            if not rows:
+                return total
+            fold(session, rows)
+            watermark.last_id = rows[-1].id
+        total += len(rows)
+        metrics.incr(f"analytics.rollup.rows.{name}", len(rows))
+
+
+def run_rollups() -> Dict[str, int]:
+    """Fold raw rows added since the last run into the daily rollups.
+
+    Every batch and its watermark are committed in one transaction, so rows
+    are counted exactly once even if the job is interrupted.
+
+    Returns:
+        Dict[str, int]: Number of raw rows folded per source table
+    """
+    return {
+        "search_history": _run_source(
+            "search_history", SearchHistory, _fold_search_history
+        ),
+        "qa_feedback": _run_source("qa_feedback", QAFeedback, _fold_feedback),
+    }
+
+
+def get_daily_rollups(start: date, end: date, product: str = "") -> Dict[str, Any]:
+    """Get the rollups of a date range.
+
+    Args:
+        start: First day included
+        end: Last day included
+        product: Only return rollups of this product if set
+
+    Returns:
+        Dict[str, Any]: Mode mix, top queries, session depth and feedback rows
+    """
+
+    def filtered(session: Session, model):
+        query = session.query(model).filter(model.day >= start, model.day <= end)
+        if product:
+            query = query.filter(model.product == product)
+        return query
+
+    with db.get_session() as session:
+        queries = [
+            {
+                "day": r.day.isoformat(),
+                "product": r.product,
+                "mode": r.mode,
+                "query_count": r.query_count,
+                "session_count": r.session_count,
+            }
+            for r in filtered(session, QueryDailyRollup).order_by(
+                QueryDailyRollup.day, QueryDailyRollup.product, QueryDailyRollup.mode
+            )
+        ]
+
+        rank = (
+            func.row_number()
+            .over(
+                partition_by=(TopQueryDailyRollup.day, TopQueryDailyRollup.product),
+                order_by=TopQueryDailyRollup.count.desc(),
+            )
+            .label("rank")
+        )
+        ranked = filtered(session, TopQueryDailyRollup).add_columns(rank).subquery()
+        top_queries = [
+            {
+                "day": r.day.isoformat(),
+                "product": r.product,
+                "query": r.query,
+                "count": r.count,
+            }
+            for r in session.query(ranked)
+            .filter(ranked.c.rank <= TOP_QUERIES_LIMIT)
+            .order_by(ranked.c.day, ranked.c.product, ranked.c.rank)
+        ]
+
+        session_depth = [
+            {
+                "day": r.day.isoformat(),
+                "product": r.product,
+                "depth": r.depth,
+                "session_count": r.session_count,
+            }
+            for r in filtered(session, SessionDepthDailyRollup).order_by(
+                SessionDepthDailyRollup.day,
+                SessionDepthDailyRollup.product,
+                SessionDepthDailyRollup.depth,
+            )
+        ]
+
+        feedback = [
+            {
+                "day": r.day.isoformat(),
+                "product": r.product,
+                "rating": r.rating,
+                "count": r.count,
+            }
+            for r in filtered(session, FeedbackDailyRollup).order_by(
+                FeedbackDailyRollup.day,
+                FeedbackDailyRollup.product,
+                FeedbackDailyRollup.rating,
+            )
+        ]
+
+    return {
+        "queries": queries,
+        "top_queries": top_queries,
+        "session_depth": session_depth,
+        "feedback": feedback,
+    }
+
+
+class RollupScheduler:
+    """Runs run_rollups periodically on a background thread."""
+
+    def __init__(self, interval: float = ROLLUP_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                folded = run_rollups()
+                logger.info(f"Analytics rollups updated: {folded}")
+            except Exception as e:
+                logger.error(f"Error updating analytics rollups: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="analytics-rollup", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+
+# Create a singleton instance
+rollup_scheduler = RollupScheduler()
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from qdrant_client import AsyncQdrantClient
+from ragapp.common.metrics import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Alias refresh configuration
+ALIAS_REFRESH_INTERVAL = 10  # Refresh every 10 seconds
+
+# Published collections are exposed as {category}_{product}_prod aliases
+SEARCH_CATEGORIES = ["doc", "forum_qa", "forum_tutorial", "generic"]
+ALIAS_SUFFIX = "_prod"
+
+# Collections shared by several products are searched for the product listed
+# here, e.g. forum_qa_spreadjsgcexcel_prod serves spreadjs
+SHARED_COLLECTION_PRODUCTS = {"spreadjsgcexcel": "spreadjs"}
+
+# Unified collections hold all categories of a product, with the category of
+# every point in an indexed collection_category payload field. The ETL points
+# each {category}_{product}_prod alias of the product at the same collection.
+UNIFIED_COLLECTION_PREFIX = "unified_"
+
+
+def parse_alias(alias_name: str) -> Optional[Tuple[str, str]]:
+    """Get the (category, product) of a published alias, or None."""
+    if not alias_name.endswith(ALIAS_SUFFIX):
+        return None
+    name = alias_name[: -len(ALIAS_SUFFIX)]
+    for category in SEARCH_CATEGORIES:
+        if name.startswith(category + "_") and len(name) > len(category) + 1:
+            product = name[len(category) + 1 :]
+            return category, SHARED_COLLECTION_PRODUCTS.get(product, product)
+    return None
+
+
+class CollectionAliases:
+    """Tracks which tagged collection every Qdrant alias currently points to.
+
+    The alias map is refreshed in the background, so that results cached for
+    a `*_prod` alias can be keyed by the collection behind it and stop being
+    served as soon as the alias is swapped to a newly published collection.
+
+    It also routes searches: a product is only searched in the categories
+    that currently have a published alias for it.
+    """
+
+    def __init__(self, refresh_interval: float = ALIAS_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._aliases: Optional[Dict[str, str]] = None
+        # {product: [(category, alias name)]} in SEARCH_CATEGORIES order
+        self._routes: Dict[str, List[Tuple[str, str]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._load_lock = asyncio.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._aliases is not None
+
+    def resolve(self, alias_name: str) -> Optional[str]:
+        """Get the collection an alias points to, or None if it is unknown."""
+        if self._aliases is None:
+            return None
+        return self._aliases.get(alias_name)
+
+    def is_unified(self, alias_name: str) -> bool:
+        """Whether an alias points to a unified collection."""
+        collection_name = self.resolve(alias_name)
+        return collection_name is not None and collection_name.startswith(
+            UNIFIED_COLLECTION_PREFIX
+        )
+
+    def version(self, alias_names: List[str]) -> Optional[Tuple[Optional[str], ...]]:
+        """Get the collections behind a set of aliases.
+
+        Returns:
+            A tuple identifying the current data of the aliases, or None if
+            the alias map has not been loaded yet
+        """
+        if self._aliases is None:
+            return None
+        return tuple(self._aliases.get(name) for name in alias_names)
+
+    def routes(self, product: str) -> List[Tuple[str, str]]:
+        """Get the (category, alias name) pairs to search for a product.
+
+        Until the alias map is loaded, every category is assumed to exist.
+        """
+        if self._aliases is None:
+            return [
+                (category, f"{category}_{product}{ALIAS_SUFFIX}")
+                for category in SEARCH_CATEGORIES
+            ]
+        return list(self._routes.get(product, []))
+
+    def products(self, category: str) -> List[str]:
+        """Get the products with a published alias in a category."""
+        return sorted(
+            product
+            for product, routes in self._routes.items()
+            if any(route_category == category for route_category, _ in routes)
+        )
+
+    def _build_routes(self, aliases: Dict[str, str]) -> Dict[str, List]:
+        routes: Dict[str, List[Tuple[str, str]]] = {}
+        for alias_name in aliases:
+            parsed = parse_alias(alias_name)
+            if parsed is not None:
+                category, product = parsed
+                routes.setdefault(product, []).append((category, alias_name))
+        for product_routes in routes.values():
+            product_routes.sort(key=lambda route: SEARCH_CATEGORIES.index(route[0]))
+        return routes
+
+    async def refresh(self, client: AsyncQdrantClient) -> None:
+        response = await client.get_aliases()
+        aliases = {
+            alias.alias_name: alias.collection_name for alias in response.aliases
+        }
+        if self._aliases is not None and aliases != self._aliases:
+            logger.info("Collection aliases changed, cached search results expire")
+        self._routes = self._build_routes(aliases)
+        self._aliases = aliases
+
+    async def ensure_loaded(self, client: AsyncQdrantClient) -> None:
+        """Load the alias map now if the background refresh has not yet."""
+        if self._aliases is None:
+            async with self._load_lock:
+                if self._aliases is None:
+                    await self.refresh(client)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self.loaded,
+            "aliases": len(self._aliases or {}),
+            "routes": {
+                product: [alias_name for _, alias_name in routes]
+                for product, routes in self._routes.items()
+            },
+        }
+
+    async def _refresh_loop(self, client: AsyncQdrantClient) -> None:
+        while True:
+            try:
+                await self.refresh(client)
+            except Exception as e:
+                logger.error(f"Error refreshing collection aliases: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self, client: AsyncQdrantClient) -> None:
+        """Start refreshing the alias map in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop(client))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Create a singleton instance
+collection_aliases = CollectionAliases()
+metrics.register("collections", collection_aliases.stats)
@@ -1,8 +1,7 @@
 from typing import List, Dict
-from qdrant_client import QdrantClient
 import logging
 
-from ragapp.common.config import app_config
+from ragapp.services.collection import collection_aliases
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -31,41 +30,22 @@ FIXED_PRODUCTS = {
 def get_generic_products() -> List[Dict]:
     """
     Get dynamic product list in generic mode
-    This can be obtained from database, configuration files or other data sources
+    The products are taken from the collection routing registry, which is
+    refreshed in the background from the Qdrant aliases
     """
-    try:
-        # Initialize vector database client
-        url = app_config.vector_db.host
-        client = QdrantClient(url)
-
-        # Get all collections
-        response = client.get_aliases()
-
-        # Extract generic products
-        generic_products = []
-        for alia in response.aliases:
-            if alia.alias_name.startswith("generic_") and alia.alias_name.endswith(
-                "_prod"
-            ):
-                # Extract product ID from collection name: generic_productname_prod -> productname
-                product_id = alia.alias_name[
-                    8:-5
-                ]  # Remove 'generic_' prefix and '_prod' suffix
-
-                generic_products.append(
-                    {
-                        "id": product_id,
-                        "name": product_id.title(),  # Capitalize first letter
-                        "display_name": f"ProductName.{product_id.title()}",
-                        "type": "generic",
-                    }
-                )
-
-        return generic_products
-
-    except Exception as e:
-        logger.error(f"Error getting generic products: {e}")
-        return []
+    if not collection_aliases.loaded:
+        logger.warning("Collection aliases are not loaded yet, no generic products")
+
+    # Products with a generic_{product}_prod alias
+    return [
+        {
+            "id": product_id,
+            "name": product_id.title(),  # Capitalize first letter
+            "display_name": f"ProductName.{product_id.title()}",
+            "type": "generic",
+        }
+        for product_id in collection_aliases.products("generic")
+    ]
 
 
 def get_available_products(mode: str = "fixed") -> Dict:
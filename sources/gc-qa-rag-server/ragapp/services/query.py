@@ -1,26 +1,26 @@
-from openai import AsyncOpenAI
-from ragapp.common.config import app_config
+from contextlib import aclosing
+from typing import Optional
+from ragapp.common.cache import create_cache, make_cache_key, normalize_text
+from ragapp.common.llm_client import llm_clients
+from ragapp.common.llm import get_llm_full_result
 
-client = AsyncOpenAI(
-    api_key=app_config.llm_query.api_key,
-    base_url=app_config.llm_query.api_base,
+# Rewritten query cache configuration
+REWRITE_CACHE_SIZE = 5000
+REWRITE_CACHE_TTL = 60 * 60  # Cache for 1 hour
+
+_rewrite_cache = create_cache(
+    "rewrite", maxsize=REWRITE_CACHE_SIZE, ttl=REWRITE_CACHE_TTL
 )
-model_name = app_config.llm_query.model_name
 
 
 async def chat(messages):
-    completion = await client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-        top_p=0.7,
-        temperature=0.7,
-        stream=True,
-    )
-
-    async for chunk in completion:
-        text = chunk.choices[0].delta.content
-        if text is not None and len(text):
-            yield text
+    stream = llm_clients.get("query").stream(messages, top_p=0.7, temperature=0.7)
+    # Closing the stream stops the generation if the consumer goes away
+    async with aclosing(stream):
+        async for chunk in stream:
+            text = chunk.choices[0].delta.content
+            if text is not None and len(text):
+                yield text
 
 
 async def chat_for_query(contents):
@@ -38,3 +38,30 @@ async def chat_for_query(contents):
         {"role": "user", "content": prompt},
     ]
     return chat(messages)
+
+
+def get_conversation_key(messages) -> str:
+    """Identify a conversation by the normalized role and content of its turns."""
+    return make_cache_key(
+        [
+            (message.get("role", ""), normalize_text(message.get("content", "")))
+            for message in messages
+        ]
+    )
+
+
+async def get_cached_rewrite(messages) -> Optional[str]:
+    """Get the cached standalone query of a conversation, if any."""
+    return await _rewrite_cache.aget(get_conversation_key(messages))
+
+
+async def rewrite_query(messages, lookup_cache: bool = True) -> str:
+    """Get the standalone query of a conversation, cached by conversation.
+
+    Pass lookup_cache=False if get_cached_rewrite was just consulted.
+    """
+    keyword = await get_cached_rewrite(messages) if lookup_cache else None
+    if keyword is None:
+        keyword = await get_llm_full_result(chat_for_query, messages)
+        await _rewrite_cache.aset(get_conversation_key(messages), keyword)
+    return keyword
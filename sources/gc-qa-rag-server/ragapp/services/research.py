@@ -2,39 +2,35 @@ import asyncio
 import json
 import re
 import logging
-from openai import AsyncOpenAI
-from ragapp.common.llm import get_llm_full_result
+from contextlib import aclosing
+from typing import Any, List
+from ragapp.common.llm import SSEEvent, get_llm_full_result
+from ragapp.common.metrics import metrics
 from ragapp.services.summary import summary_hits
-from ragapp.services.search import search_sementic_hybrid
+from ragapp.services.search import search_sementic_hybrid_async
 from ragapp.services.think import summary_hits_think
-from ragapp.common.config import app_config
+from ragapp.common.llm_client import llm_clients
+from ragapp.common.context import build_hits_context
 
 logger = logging.getLogger(__name__)
 
-client = AsyncOpenAI(
-    api_key=app_config.llm_research.api_key,
-    base_url=app_config.llm_research.api_base,
-)
-model_name = app_config.llm_research.model_name
+# Research executor configuration
+RESEARCH_MAX_CONCURRENCY = 4  # Sub-questions answered at the same time
+RESEARCH_MAX_SUB_QUESTIONS = 8  # Further sub-questions are dropped
 
 
 async def chat(messages):
-    completion = await client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-        top_p=0.7,
-        temperature=0.7,
-        stream=True,
-    )
-
-    async for chunk in completion:
-        text = chunk.choices[0].delta.content
-        if text is not None and len(text):
-            yield text
+    stream = llm_clients.get("research").stream(messages, top_p=0.7, temperature=0.7)
+    # Closing the stream stops the generation if the consumer goes away
+    async with aclosing(stream):
+        async for chunk in stream:
+            text = chunk.choices[0].delta.content
+            if text is not None and len(text):
+                yield text
 
 
 async def split_questions(keyword, messages, hits):
-    hits_text = json.dumps(hits, ensure_ascii=False, default=vars)
+    hits_text = build_hits_context(hits, include_full_answer=False)
 
     hits_prompt = f"""请综合参考上下文以及下面的用户问题和知识库检索结果，把用户的问题拆解为若干个子问题，输出子问题列表，输出为JSON格式。
 ## 输出格式
@@ -56,7 +52,7 @@ async def split_questions(keyword, messages, hits):
         }
     ] + messages
 
-    messages_with_hits[-1]["content"] = hits_prompt
+    messages_with_hits[-1] = {**messages_with_hits[-1], "content": hits_prompt}
     logger.debug(
         "summary_hits words: "
         + str(len(json.dumps(messages_with_hits, ensure_ascii=False, default=vars)))
@@ -64,39 +60,147 @@ async def split_questions(keyword, messages, hits):
     return chat(messages_with_hits)
 
 
-async def research_hits(client, keyword, messages, hits, product, extra_instruction=""):
-    logger.info(f"Researching hits for keyword: {keyword}")
+class ResearchExecutor:
+    """Answers the sub-questions of a research with bounded concurrency.
 
-    # hits = search_sementic_hybrid(client, keyword, product)
+    Sub-questions are submitted as they become known; their answers can be
+    consumed in completion order while the remaining ones are still running.
+    """
 
-    # Generate questions
-    questions_str = await get_llm_full_result(split_questions, keyword, messages, hits)
-    questions = json.loads(extract_json_content(questions_str))
-    logger.debug(f"Generated sub-questions: {questions}")
+    def __init__(
+        self,
+        client,
+        messages,
+        product,
+        extra_instruction="",
+        max_concurrency=RESEARCH_MAX_CONCURRENCY,
+    ):
+        self.client = client
+        self.messages = messages
+        self.product = product
+        self.extra_instruction = extra_instruction
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: List[asyncio.Task] = []
+        self._completed: asyncio.Queue = asyncio.Queue()
+        self._closed = False
 
-    # Process sub question
-    async def process_sub_question(sub_question):
-        logger.debug(f"Processing sub-question: {sub_question}")
+    def submit(self, sub_question: str) -> None:
+        if len(self._tasks) >= RESEARCH_MAX_SUB_QUESTIONS:
+            metrics.incr("research.sub_question.dropped")
+            logger.info(f"Too many sub-questions, dropped: {sub_question}")
+            return
 
-        sub_hits = search_sementic_hybrid(client, sub_question, product)
-        sub_answer = await get_llm_full_result(
-            summary_hits, sub_question, messages, sub_hits, extra_instruction
-        )
-        return sub_question, sub_answer
+        index = len(self._tasks)
+        task = asyncio.ensure_future(self._answer(index, sub_question))
+        task.add_done_callback(self._completed.put_nowait)
+        self._tasks.append(task)
+
+    def close(self) -> None:
+        """Mark that no more sub-questions will be submitted."""
+        self._closed = True
+        self._completed.put_nowait(None)
+
+    async def _answer(self, index: int, sub_question: str):
+        async with self._semaphore:
+            logger.debug(f"Processing sub-question: {sub_question}")
+            sub_hits = await search_sementic_hybrid_async(
+                self.client, sub_question, self.product
+            )
+            sub_answer = await get_llm_full_result(
+                summary_hits,
+                sub_question,
+                self.messages,
+                sub_hits,
+                self.extra_instruction,
+            )
+        return index, sub_question, sub_answer
+
+    async def as_completed(self):
+        """Yield (index, sub_question, sub_answer) as answers complete.
+
+        Ends once the executor is closed and every submitted sub-question is
+        answered.
+        """
+        finished = 0
+        while not (self._closed and finished == len(self._tasks)):
+            task = await self._completed.get()
+            if task is None:
+                continue
+            finished += 1
+            yield task.result()
 
-    # Parallel execute
-    sub_answers = {}
-    tasks = [process_sub_question(sub_question) for sub_question in questions]
-    results = await asyncio.gather(*tasks)
+    async def cancel(self) -> None:
+        """Stop the sub-questions still running."""
+        pending = [task for task in self._tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            metrics.incr("research.sub_question.cancelled", len(pending))
+            await asyncio.wait(pending)
 
-    # Merge answers
-    for sub_question, sub_answer in results:
-        sub_answers[sub_question] = sub_answer
-        messages.insert(-1, {"role": "user", "content": sub_question})
-        messages.insert(-1, {"role": "assistant", "content": sub_answer})
 
-    # Summary the final answer
-    return await summary_hits_think(keyword, messages, hits, extra_instruction)
+async def research_hits(
+    client,
+    keyword,
+    messages,
+    hits,
+    product,
+    extra_instruction="",
+    stream_sub_answers=False,
+):
+    logger.info(f"Researching hits for keyword: {keyword}")
+
+    executor = ResearchExecutor(client, messages, product, extra_instruction)
+
+    # Generate questions, each one is answered as soon as the planner has
+    # finished writing it
+    async def plan():
+        try:
+            planner = await split_questions(keyword, messages, hits)
+            async for sub_question in iter_json_array(planner):
+                if not isinstance(sub_question, str):
+                    sub_question = json.dumps(sub_question, ensure_ascii=False)
+                logger.debug(f"Generated sub-question: {sub_question}")
+                executor.submit(sub_question)
+        finally:
+            executor.close()
+
+    async def wrapper():
+        # Answer the sub-questions, stopping the planner and the remaining
+        # sub-questions when the research is cancelled or one of them fails
+        planning = asyncio.ensure_future(plan())
+        results = []
+        try:
+            async for index, sub_question, sub_answer in executor.as_completed():
+                if stream_sub_answers:
+                    yield SSEEvent(
+                        "sub_answer", {"question": sub_question, "answer": sub_answer}
+                    )
+                results.append((index, sub_question, sub_answer))
+            await planning
+        finally:
+            if not planning.done():
+                planning.cancel()
+                await asyncio.wait({planning})
+            await executor.cancel()
+
+        # Merge answers in question order, the caller's messages are left untouched
+        sub_messages = []
+        for _, sub_question, sub_answer in sorted(results):
+            sub_messages.append({"role": "user", "content": sub_question})
+            sub_messages.append({"role": "assistant", "content": sub_answer})
+
+        # Summary the final answer
+        result_gen = await summary_hits_think(
+            keyword,
+            messages[:-1] + sub_messages + messages[-1:],
+            hits,
+            extra_instruction,
+        )
+        async for text in result_gen:
+            yield text
+
+    return wrapper()
 
 
 def extract_json_content(text):
@@ -107,3 +211,89 @@ def extract_json_content(text):
         return match.group(1)
     else:
         return text
+
+
+class JsonArrayParser:
+    """Incrementally extracts the elements of the first JSON array in a text.
+
+    Text before the opening bracket, such as a markdown code fence, is
+    skipped; every element is returned as soon as its closing delimiter has
+    been fed.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element: List[str] = []
+
+    def feed(self, text: str) -> List[Any]:
+        """Feed the next chunk of text and get the elements it completed."""
+        items = []
+        for char in text:
+            if self.done:
+                break
+
+            if not self.started:
+                if char == "[":
+                    self.started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                self._element.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+            elif char in "]}":
+                self._depth -= 1
+
+            if self._depth == 0 or (self._depth == 1 and char == ","):
+                self._flush(items)
+                self.done = self._depth == 0
+                continue
+
+            self._element.append(char)
+        return items
+
+    def _flush(self, items: List[Any]) -> None:
+        element = "".join(self._element).strip()
+        self._element = []
+        if not element:
+            return
+        try:
+            items.append(json.loads(element))
+        except ValueError:
+            logger.warning(f"Skipped invalid JSON array element: {element}")
+
+
+async def iter_json_array(chunks):
+    """Yield the elements of the JSON array written by a text stream.
+
+    Falls back to parsing the whole text once the stream ends if no element
+    could be extracted incrementally.
+    """
+    parser = JsonArrayParser()
+    text = []
+    found = False
+    async for chunk in chunks:
+        text.append(chunk)
+        for item in parser.feed(chunk):
+            found = True
+            yield item
+
+    if not found:
+        items = json.loads(extract_json_content("".join(text)))
+        for item in items:
+            yield item
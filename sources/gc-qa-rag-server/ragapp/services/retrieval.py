@@ -0,0 +1,63 @@
+import uuid
+import logging
+from typing import List, Optional
+from ragapp.common.cache import create_cache, normalize_text
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Retrieval handle configuration
+RETRIEVAL_STORE_SIZE = 5000
+RETRIEVAL_TTL = 5 * 60  # Handles expire after 5 minutes
+
+_retrieval_store = create_cache(
+    "retrieval", maxsize=RETRIEVAL_STORE_SIZE, ttl=RETRIEVAL_TTL
+)
+
+
+async def save_retrieval(keyword: str, product: str, hits: List) -> str:
+    """Store the hits of a search and return a short-lived handle to them.
+
+    Args:
+        keyword: The searched keyword
+        product: The searched product
+        hits: The merged search hits
+
+    Returns:
+        str: The retrieval id
+    """
+    retrieval_id = uuid.uuid4().hex
+    await _retrieval_store.aset(
+        retrieval_id,
+        {"keyword": normalize_text(keyword), "product": product, "hits": hits},
+    )
+    return retrieval_id
+
+
+async def load_retrieval(
+    retrieval_id: str, keyword: str, product: str
+) -> Optional[List]:
+    """Get the hits behind a retrieval id if they answer the same search.
+
+    Args:
+        retrieval_id: The id returned by save_retrieval
+        keyword: The keyword the caller is about to search
+        product: The product the caller is about to search
+
+    Returns:
+        The stored hits, or None if the handle is unknown, expired or was
+        created for a different keyword or product
+    """
+    if not retrieval_id:
+        return None
+
+    entry = await _retrieval_store.aget(retrieval_id)
+    if entry is None:
+        logger.info(f"Retrieval {retrieval_id} not found or expired")
+        return None
+
+    if entry["keyword"] != normalize_text(keyword) or entry["product"] != product:
+        logger.info(f"Retrieval {retrieval_id} does not match the current search")
+        return None
+
+    return list(entry["hits"])
@@ -0,0 +1,180 @@
+import math
+import random
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+from qdrant_client import AsyncQdrantClient
+from ragapp.common.metrics import metrics
+from ragapp.services.collection import collection_aliases
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Collection with one centroid per published collection, written by the ETL
+CENTROID_COLLECTION = "collection_centroids"
+CENTROID_REFRESH_INTERVAL = 60  # Refresh every minute
+
+# Routing configuration
+ROUTER_MIN_COLLECTIONS = 2  # Best scoring collections always searched
+ROUTER_MARGIN = 0.05  # Collections this close to the best score are searched too
+ROUTER_SHADOW_RATE = 0.05  # Share of searches also querying skipped collections
+ROUTER_RECALL_TOP_K = 8  # Hits checked for skipped collections in shadow searches
+
+
+def _normalize(vector: List[float]) -> Optional[List[float]]:
+    norm = math.sqrt(sum(value * value for value in vector))
+    if not norm:
+        return None
+    return [value / norm for value in vector]
+
+
+class CategoryRouter:
+    """Skips the collections of a product that are unlikely to answer a query.
+
+    Every collection is scored by the cosine similarity between the query's
+    dense embedding and the collection's centroid computed at publish time.
+    The best scoring collections, those within a margin of the best and
+    those without a centroid are searched; the others are skipped.
+
+    As a recall safeguard, a sample of searches also queries the skipped
+    collections and counts how often they would have contributed top hits.
+    """
+
+    def __init__(self, refresh_interval: float = CENTROID_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        # {(tagged collection name, category or None): unit centroid}, the
+        # category is set for the centroids of unified collections
+        self._centroids: Dict[Tuple[str, Optional[str]], List[float]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.routed = 0
+        self.searched = 0
+        self.skipped = 0
+        self.shadowed = 0
+        self.recall_misses = 0
+
+    def _centroid(self, category: str, alias_name: str) -> Optional[List[float]]:
+        collection_name = collection_aliases.resolve(alias_name)
+        if collection_name is None:
+            return None
+        centroid = self._centroids.get((collection_name, category))
+        if centroid is None:
+            centroid = self._centroids.get((collection_name, None))
+        return centroid
+
+    def select(
+        self, routes: List[Tuple[str, str]], dense: List[float]
+    ) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        """Split the routes of a product into searched and skipped ones.
+
+        Args:
+            routes: (category, alias name) pairs of the product
+            dense: Dense embedding of the query
+
+        Returns:
+            The routes to search and the routes skipped, both in input order
+        """
+        query = _normalize(dense)
+        if query is None or len(routes) <= ROUTER_MIN_COLLECTIONS:
+            return list(routes), []
+
+        scores: Dict[str, float] = {}
+        for category, alias_name in routes:
+            centroid = self._centroid(category, alias_name)
+            if centroid is not None:
+                scores[alias_name] = sum(a * b for a, b in zip(query, centroid))
+
+        ranked = sorted(scores.values(), reverse=True)
+        if len(ranked) <= ROUTER_MIN_COLLECTIONS:
+            return list(routes), []
+        cutoff = min(ranked[ROUTER_MIN_COLLECTIONS - 1], ranked[0] - ROUTER_MARGIN)
+
+        selected, skipped = [], []
+        for route in routes:
+            score = scores.get(route[1])
+            if score is None or score >= cutoff:
+                selected.append(route)
+            else:
+                skipped.append(route)
+
+        self.routed += 1
+        self.searched += len(selected)
+        self.skipped += len(skipped)
+        return selected, skipped
+
+    def sample_shadow(self) -> bool:
+        """Whether a search should also query its skipped collections."""
+        return random.random() < ROUTER_SHADOW_RATE
+
+    def check_recall(self, hits: List, skipped_categories: Set[str]) -> None:
+        """Count whether skipped collections placed hits in the top results."""
+        self.shadowed += 1
+        top = hits[:ROUTER_RECALL_TOP_K]
+        if any(hit.payload["collection_category"] in skipped_categories for hit in top):
+            self.recall_misses += 1
+
+    async def refresh(self, client: AsyncQdrantClient) -> None:
+        if not await client.collection_exists(CENTROID_COLLECTION):
+            self._centroids = {}
+            return
+
+        centroids = {}
+        offset = None
+        while True:
+            points, offset = await client.scroll(
+                collection_name=CENTROID_COLLECTION,
+                limit=256,
+                offset=offset,
+                with_payload=["collection_name", "collection_category"],
+                with_vectors=True,
+            )
+            for point in points:
+                centroid = _normalize(point.vector)
+                if centroid is not None:
+                    key = (
+                        point.payload["collection_name"],
+                        point.payload.get("collection_category"),
+                    )
+                    centroids[key] = centroid
+            if offset is None:
+                break
+        self._centroids = centroids
+
+    async def _refresh_loop(self, client: AsyncQdrantClient) -> None:
+        while True:
+            try:
+                await self.refresh(client)
+            except Exception as e:
+                logger.error(f"Error refreshing collection centroids: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self, client: AsyncQdrantClient) -> None:
+        """Start refreshing the centroids in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop(client))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "centroids": len(self._centroids),
+            "routed": self.routed,
+            "searched": self.searched,
+            "skipped": self.skipped,
+            "shadowed": self.shadowed,
+            "recall_misses": self.recall_misses,
+            "recall_miss_rate": (
+                round(self.recall_misses / self.shadowed, 4) if self.shadowed else 0.0
+            ),
+        }
+
+
+# Create a singleton instance
+category_router = CategoryRouter()
+metrics.register("router", category_router.stats)
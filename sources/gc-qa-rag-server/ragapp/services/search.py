@@ -1,33 +1,58 @@
-from typing import List
-from http import HTTPStatus
-from qdrant_client import QdrantClient, models
+from typing import Dict, List, Tuple
+import asyncio
+import math
+import random
+from qdrant_client import AsyncQdrantClient, models
 import logging
 
-from ragapp.common.embedding import create_embedding
+from ragapp.common.cache import create_cache, make_cache_key, normalize_text
+from ragapp.common.config import app_config
+from ragapp.common.embedding import get_query_embeddings_async
+from ragapp.common.metrics import metrics
+from ragapp.common.singleflight import SingleFlight
+from ragapp.services.collection import collection_aliases
+from ragapp.services.router import category_router
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
-collection_name_map = {
-    "doc": {
-        "forguncy": "doc_forguncy_prod",
-        "wyn": "doc_wyn_prod",
-        "spreadjs": "doc_spreadjs_prod",
-        "gcexcel": "doc_gcexcel_prod",
-    },
-    "forum_qa": {
-        "forguncy": "forum_qa_forguncy_prod",
-        "wyn": "forum_qa_wyn_prod",
-        "spreadjs": "forum_qa_spreadjsgcexcel_prod",
-        "gcexcel": "",
-    },
-    "forum_tutorial": {
-        "forguncy": "forum_tutorial_forguncy_prod",
-        "wyn": "forum_tutorial_wyn_prod",
-        "spreadjs": "forum_tutorial_spreadjsgcexcel_prod",
-        "gcexcel": "",
-    },
-}
+# Every collection returns the best hit of its most relevant documents, from
+# the candidates of each prefetch
+SEARCH_DOCUMENTS_PER_COLLECTION = 8
+SEARCH_HITS_PER_DOCUMENT = 1
+SEARCH_PREFETCH_LIMIT = 24
+
+# Payload field of unified collections combining collection_category and
+# file_index, written by the ETL
+CATEGORY_DOCUMENT_FIELD = "category_file_index"
+
+# A sample of searches is repeated in the background with the prefetch limit
+# used before grouping, to measure the documents the smaller limit misses
+SEARCH_RECALL_SAMPLE_RATE = 0.02
+SEARCH_RECALL_PREFETCH_LIMIT = 40
+
+# Payload fields used by the prompts, the search results and grouping
+SEARCH_PAYLOAD_FIELDS = [
+    "file_index",
+    "question",
+    "answer",
+    "full_answer",
+    "url",
+    "title",
+    "category",
+    "date",
+    "collection_category",
+]
+
+# Search result cache configuration
+SEARCH_CACHE_SIZE = 2000
+SEARCH_CACHE_TTL = 60 * 60  # Cache for 1 hour
+
+_search_cache = create_cache("search", maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+# Identical searches running at the same time share one retrieval
+_search_flight = SingleFlight("search")
+metrics.register("singleflight.search", _search_flight.stats)
 
 
 def transform_sparse(embedding):
@@ -37,94 +62,413 @@ def transform_sparse(embedding):
     }
 
 
-def get_embedding_pair(inputs: List):
-    resp = create_embedding(inputs)
+async def get_embedding_pair_async(inputs: List):
+    return (await get_query_embeddings_async(inputs))[0]
 
-    if resp.status_code == HTTPStatus.OK:
-        return resp.output["embeddings"][0]
-    else:
-        return {"embedding": [], "sparse_embedding": []}
 
+def clean_search_hits(hits):
+    # clean id&version information to avoid AI generation's mistake
+    for hit in hits:
+        hit.id = None
+        hit.version = None
+    return hits
 
-def distinct_clean_search_hits(hits):
-    seen_ids = set()
-    unique_data = []
 
-    for hit in hits:
-        key = (
-            str(hit.payload["file_index"])
-            + "_"
-            + str(hit.payload.get("group_index", "_"))
-            + "_"
-            + str(hit.payload["question_index"])
-        )
-        if key not in seen_ids:
-            seen_ids.add(key)
-            unique_data.append(hit)
+def get_group_hits(result):
+    """Flatten the groups of a grouped query, best group first."""
+    return clean_search_hits([hit for group in result.groups for hit in group.hits])
 
-            # clean id&version information to avoid AI generation's mistake
-            hit.id = None
-            hit.version = None
 
-    return unique_data
+def get_search_collections(product) -> List[Tuple[str, str]]:
+    """Return the (category, collection_name) pairs searched for a product."""
+    return collection_aliases.routes(product)
 
 
-def search_sementic_hybrid(client: QdrantClient, query, product):
-    all_hits = []
+def plan_collection_searches(routes) -> List[Tuple[str, List[str], bool]]:
+    """Group the routes of a product into the queries answering them.
 
-    categories = ["doc", "forum_qa", "forum_tutorial"]
-    for category in categories:
-        try:
-            collection_name = collection_name_map[category][product]
-            hits = search_sementic_hybrid_single(client, query, collection_name)
-            for hit in hits:
-                hit.payload["collection_category"] = category
-            all_hits += hits
-        except Exception as e:
-            logger.error(f"Error searching {category} {product}: {e}")
+    Aliases pointing to the same unified collection are answered by one
+    grouped query, every other alias by a query of its own.
 
-    try:
-        hits = search_sementic_hybrid_single(client, query, f"generic_{product}_prod")
-        for hit in hits:
-            hit.payload["collection_category"] = "generic"
-        all_hits += hits
-    except Exception as e:
-        logger.error(f"Error searching generic {product}: {e}")
+    Args:
+        routes: (category, collection_name) pairs to search
+
+    Returns:
+        (collection_name, categories, unified) of every query, in route order
+    """
+    plan = []
+    unified = {}
+    for category, collection_name in routes:
+        if not collection_aliases.is_unified(collection_name):
+            plan.append((collection_name, [category], False))
+            continue
+        target = collection_aliases.resolve(collection_name)
+        if target not in unified:
+            unified[target] = (collection_name, [], True)
+            plan.append(unified[target])
+        unified[target][1].append(category)
+    return plan
 
-    return sorted(all_hits, key=lambda x: x.score, reverse=True)
 
+async def get_query_similarity_async(query_a, query_b) -> float:
+    """Cosine similarity of the dense embeddings of two queries."""
+    if normalize_text(query_a) == normalize_text(query_b):
+        return 1.0
 
-def search_sementic_hybrid_single(client: QdrantClient, query, collection):
-    pair = get_embedding_pair([query])
+    pair_a, pair_b = await get_query_embeddings_async([query_a, query_b])
+    a, b = pair_a["embedding"], pair_b["embedding"]
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+async def get_query_vectors_async(query):
+    pair = await get_embedding_pair_async([query])
     dense = pair["embedding"]
     sparse = transform_sparse(pair["sparse_embedding"])
+    return dense, sparse
 
-    result = client.query_points(
-        collection_name=collection,
-        prefetch=[
+
+def build_hybrid_query(dense, sparse, prefetch_limit=SEARCH_PREFETCH_LIMIT):
+    sparse_vector = models.SparseVector(
+        indices=sparse["indices"], values=sparse["values"]
+    )
+    return {
+        "prefetch": [
             models.Prefetch(
-                query=dense, using="question_dense", limit=40, score_threshold=0.4
+                query=dense,
+                using="question_dense",
+                limit=prefetch_limit,
+                score_threshold=0.4,
             ),
             models.Prefetch(
-                query=dense, using="answer_dense", limit=40, score_threshold=0.4
+                query=dense,
+                using="answer_dense",
+                limit=prefetch_limit,
+                score_threshold=0.4,
             ),
             models.Prefetch(
-                query=models.SparseVector(
-                    indices=sparse["indices"], values=sparse["values"]
-                ),
-                using="question_sparse",
-                limit=40,
+                query=sparse_vector, using="question_sparse", limit=prefetch_limit
             ),
             models.Prefetch(
-                query=models.SparseVector(
-                    indices=sparse["indices"], values=sparse["values"]
-                ),
-                using="answer_sparse",
-                limit=40,
+                query=sparse_vector, using="answer_sparse", limit=prefetch_limit
             ),
         ],
-        query=models.FusionQuery(fusion=models.Fusion.RRF),
-        limit=8,
-        score_threshold=0.4,
+        "query": models.FusionQuery(fusion=models.Fusion.RRF),
+        "limit": SEARCH_DOCUMENTS_PER_COLLECTION,
+        "score_threshold": 0.4,
+        "with_payload": SEARCH_PAYLOAD_FIELDS,
+    }
+
+
+def build_document_query(dense, sparse, prefetch_limit=SEARCH_PREFETCH_LIMIT):
+    """Build a hybrid query returning the best hits of distinct documents.
+
+    Qdrant groups the fused candidates by file_index, so several questions
+    of one document no longer take the places of other documents.
+    """
+    return {
+        **build_hybrid_query(dense, sparse, prefetch_limit=prefetch_limit),
+        "group_by": "file_index",
+        "group_size": SEARCH_HITS_PER_DOCUMENT,
+    }
+
+
+def build_unified_document_query(
+    dense, sparse, categories, prefetch_limit=SEARCH_PREFETCH_LIMIT
+):
+    """Build one hybrid query returning the best documents of several categories.
+
+    The hits of a unified collection are grouped by CATEGORY_DOCUMENT_FIELD,
+    so documents of different categories stay apart. The categories share
+    the prefetch candidates and the groups, so both limits are scaled by the
+    number of categories and split_category_groups applies the quota of
+    every category. The filter also applies to the prefetches.
+    """
+    query = build_hybrid_query(
+        dense, sparse, prefetch_limit=prefetch_limit * len(categories)
     )
-    return distinct_clean_search_hits(result.points)
+    return {
+        **query,
+        "query_filter": models.Filter(
+            must=[
+                models.FieldCondition(
+                    key="collection_category", match=models.MatchAny(any=categories)
+                )
+            ]
+        ),
+        "group_by": CATEGORY_DOCUMENT_FIELD,
+        "group_size": SEARCH_HITS_PER_DOCUMENT,
+        "limit": query["limit"] * len(categories),
+    }
+
+
+def split_category_groups(result, categories):
+    """Split the groups of a unified query into the hits of each category.
+
+    Groups arrive best first, and every category keeps the hits of at most
+    SEARCH_DOCUMENTS_PER_COLLECTION documents, as a collection of its own
+    would return.
+
+    Returns:
+        List of (category, hits) pairs
+    """
+    hits = {category: [] for category in categories}
+    documents = dict.fromkeys(categories, 0)
+    for group in result.groups:
+        category = group.hits[0].payload.get("collection_category")
+        if documents.get(category) is None:
+            continue
+        if documents[category] < SEARCH_DOCUMENTS_PER_COLLECTION:
+            documents[category] += 1
+            hits[category] += group.hits
+    return [(category, clean_search_hits(hits[category])) for category in categories]
+
+
+def merge_search_hits(results):
+    """Tag hits with their category and merge them in descending score order.
+
+    Args:
+        results: Iterable of (category, hits) pairs
+
+    Returns:
+        List of hits sorted by score
+    """
+    all_hits = []
+    for category, hits in results:
+        for hit in hits:
+            hit.payload["collection_category"] = category
+        all_hits += hits
+    return sorted(all_hits, key=lambda x: x.score, reverse=True)
+
+
+def get_search_cache_key(query, product):
+    """Get the search cache key, or None while the alias map is unknown.
+
+    The key includes the collections the product's aliases point to, so an
+    alias swap after publishing implicitly invalidates every cached entry.
+    """
+    collections = get_search_collections(product)
+    version = collection_aliases.version([name for _, name in collections])
+    if version is None:
+        return None
+    return make_cache_key("search", normalize_text(query), product, version)
+
+
+async def search_sementic_hybrid_async(client: AsyncQdrantClient, query, product):
+    try:
+        await collection_aliases.ensure_loaded(client)
+    except Exception as e:
+        logger.error(f"Error loading collection aliases: {e}")
+
+    cache_key = get_search_cache_key(query, product)
+    if cache_key is not None:
+        hits = await _search_cache.aget(cache_key)
+        if hits is not None:
+            return list(hits)
+
+    flight_key = cache_key or make_cache_key("search", normalize_text(query), product)
+    hits = await _search_flight.do(
+        flight_key, lambda: _search_and_cache_async(client, query, product, cache_key)
+    )
+    return list(hits)
+
+
+async def _search_and_cache_async(client: AsyncQdrantClient, query, product, cache_key):
+    hits, complete = await _search_sementic_hybrid_async(client, query, product)
+
+    # Partial results caused by embedding or collection errors are not cached
+    if cache_key is not None and complete:
+        await _search_cache.aset(cache_key, hits)
+
+    return hits
+
+
+async def _search_sementic_hybrid_async(client: AsyncQdrantClient, query, product):
+    # Products without published collections need no embedding
+    collections = get_search_collections(product)
+    if not collections:
+        return [], True
+
+    try:
+        dense, sparse = await get_query_vectors_async(query)
+    except Exception as e:
+        logger.error(f"Error embedding query for {product}: {e}")
+        return [], False
+
+    skipped = []
+    if app_config.category_router:
+        collections, skipped = category_router.select(collections, dense)
+    shadow = bool(skipped) and category_router.sample_shadow()
+    searched = collections + skipped if shadow else collections
+    plan = plan_collection_searches(searched)
+
+    responses = await asyncio.gather(
+        *[
+            search_categories_hybrid_async(
+                client, collection_name, categories, unified, dense, sparse
+            )
+            for collection_name, categories, unified in plan
+        ],
+        return_exceptions=True,
+    )
+
+    results = []
+    complete = True
+    for (collection_name, categories, _), response in zip(plan, responses):
+        if isinstance(response, BaseException):
+            logger.error(f"Error searching {categories} {collection_name}: {response}")
+            # A missing alias fails on every search and does not make it partial
+            if collection_aliases.resolve(collection_name) is not None:
+                complete = False
+        else:
+            results += response
+
+    if prefetch_recall.sample():
+        searched_plan = [
+            entry
+            for entry, response in zip(plan, responses)
+            if not isinstance(response, BaseException)
+        ]
+        prefetch_recall.start(client, searched_plan, dense, sparse, results)
+
+    hits = merge_search_hits(results)
+    if shadow:
+        category_router.check_recall(hits, {category for category, _ in skipped})
+    return hits, complete
+
+
+async def search_categories_hybrid_async(
+    client: AsyncQdrantClient,
+    collection,
+    categories,
+    unified,
+    dense,
+    sparse,
+    prefetch_limit=SEARCH_PREFETCH_LIMIT,
+):
+    """Search the categories of one query in a plan_collection_searches plan.
+
+    The categories of a unified collection are searched with one grouped
+    query.
+
+    Returns:
+        List of (category, hits) pairs
+    """
+    if not unified:
+        hits = await search_collection_hybrid_async(
+            client, collection, dense, sparse, prefetch_limit=prefetch_limit
+        )
+        return [(categories[0], hits)]
+
+    result = await client.query_points_groups(
+        collection_name=collection,
+        **build_unified_document_query(
+            dense, sparse, categories, prefetch_limit=prefetch_limit
+        ),
+    )
+    return split_category_groups(result, categories)
+
+
+async def search_collection_hybrid_async(
+    client: AsyncQdrantClient,
+    collection,
+    dense,
+    sparse,
+    prefetch_limit=SEARCH_PREFETCH_LIMIT,
+):
+    result = await client.query_points_groups(
+        collection_name=collection,
+        **build_document_query(dense, sparse, prefetch_limit=prefetch_limit),
+    )
+    return get_group_hits(result)
+
+
+class PrefetchRecall:
+    """Measures the documents searches miss because of the prefetch limit.
+
+    A sample of searches is repeated in the background with
+    SEARCH_RECALL_PREFETCH_LIMIT. Recall is the share of the documents of
+    the repeated search that the served search also returned, per query mode:
+    "collection" for collections of one category and "unified" for the
+    categories of unified collections.
+    """
+
+    MODES = ("collection", "unified")
+
+    def __init__(self):
+        self.checks = dict.fromkeys(self.MODES, 0)
+        self.expected = dict.fromkeys(self.MODES, 0)
+        self.found = dict.fromkeys(self.MODES, 0)
+        self.failed = 0
+        self._tasks = set()
+
+    def sample(self) -> bool:
+        """Whether a search should be repeated for the recall check."""
+        return random.random() < SEARCH_RECALL_SAMPLE_RATE
+
+    def start(self, client: AsyncQdrantClient, plan, dense, sparse, results) -> None:
+        """Start the recall check of a served search.
+
+        Args:
+            client: Qdrant client
+            plan: plan_collection_searches entries that were answered
+            dense: Dense query vector
+            sparse: Sparse query vector
+            results: (category, hits) pairs served for the plan
+        """
+        served = {}
+        for category, hits in results:
+            served[category] = {hit.payload.get("file_index") for hit in hits}
+
+        task = asyncio.create_task(self._check(client, plan, dense, sparse, served))
+        # Keep a reference so the task is not garbage collected while running
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _check(self, client, plan, dense, sparse, served) -> None:
+        for collection_name, categories, unified in plan:
+            mode = "unified" if unified else "collection"
+            try:
+                baseline = await search_categories_hybrid_async(
+                    client,
+                    collection_name,
+                    categories,
+                    unified,
+                    dense,
+                    sparse,
+                    prefetch_limit=SEARCH_RECALL_PREFETCH_LIMIT,
+                )
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Prefetch recall check of {categories} failed: {e}")
+                continue
+
+            for category, hits in baseline:
+                expected = {hit.payload.get("file_index") for hit in hits}
+                self.checks[mode] += 1
+                self.expected[mode] += len(expected)
+                self.found[mode] += len(expected & served.get(category, set()))
+
+    def stats(self) -> Dict:
+        return {
+            "prefetch_limit": SEARCH_PREFETCH_LIMIT,
+            "baseline_prefetch_limit": SEARCH_RECALL_PREFETCH_LIMIT,
+            "failed": self.failed,
+            **{
+                mode: {
+                    "checks": self.checks[mode],
+                    "recall": (
+                        round(self.found[mode] / self.expected[mode], 4)
+                        if self.expected[mode]
+                        else 1.0
+                    ),
+                }
+                for mode in self.MODES
+            },
+        }
+
+
+# Create a singleton instance
+prefetch_recall = PrefetchRecall()
+metrics.register("search.prefetch_recall", prefetch_recall.stats)
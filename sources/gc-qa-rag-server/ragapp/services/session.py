@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import secrets
+from typing import Dict, List, Optional
+from ragapp.common.cache import create_cache, normalize_text
+from ragapp.common.llm import SSEEvent, get_llm_full_result
+from ragapp.common.metrics import metrics
+from ragapp.services.query import get_conversation_key
+from ragapp.services.summary import summarize_conversation
+from ragapp.services.think import CONTENT_SEPARATOR
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Session store configuration
+SESSION_STORE_SIZE = 10000
+SESSION_TTL = 30 * 60  # Sessions expire 30 minutes after their last turn
+SESSION_RECENT_MESSAGES = 2  # Latest messages kept verbatim in prompts
+
+_session_store = create_cache("session", maxsize=SESSION_STORE_SIZE, ttl=SESSION_TTL)
+
+# Summaries being computed, so that a session is summarized once at a time
+_summary_tasks: Dict[str, asyncio.Task] = {}
+
+
+def new_session_id() -> str:
+    """Issue a random, unguessable session id."""
+    return secrets.token_urlsafe(24)
+
+
+async def load_session(session_id: str, client: str) -> Optional[Dict]:
+    """Get the stored state of a session of a client.
+
+    Sessions are bound to the client that created them; other clients get
+    None, as for unknown ids.
+
+    Returns:
+        A dict with the session's "turns", running "summary" (covering the
+        turns identified by "summary_key"), rewritten "queries" and the
+        "hits" of its last turn, or None if it is unknown, expired or owned
+        by another client
+    """
+    if not session_id:
+        return None
+    session = await _session_store.aget(session_id)
+    if session is not None and session.get("owner") != client:
+        metrics.incr("session.owner_mismatch")
+        return None
+    return session
+
+
+def resolve_conversation(session: Optional[Dict], messages: List) -> List:
+    """Get the full conversation of a request.
+
+    Clients of a known session may send only the new message; the stored
+    turns are then prepended. Full histories are used as they are.
+    """
+    if session and session["turns"] and len(messages) == 1:
+        return session["turns"] + messages
+    return list(messages)
+
+
+def build_prompt_messages(session: Optional[Dict], conversation: List) -> List:
+    """Replace the summarized part of a conversation with its running summary.
+
+    The summary is only used if it was computed for exactly the leading
+    turns of this conversation.
+    """
+    if not session or not session.get("summary"):
+        return list(conversation)
+
+    count = session["summary_count"]
+    if count >= len(conversation):
+        return list(conversation)
+    if get_conversation_key(conversation[:count]) != session["summary_key"]:
+        return list(conversation)
+
+    metrics.incr("session.summary_used")
+    return [
+        {
+            "role": "user",
+            "content": f"以下是之前对话的摘要：\n{session['summary']}",
+        },
+        {"role": "assistant", "content": "好的，我已了解之前的对话。"},
+    ] + conversation[count:]
+
+
+def strip_reasoning(answer: str) -> str:
+    """Get the answer of a think-mode response without its reasoning."""
+    return answer.split(CONTENT_SEPARATOR, 1)[-1]
+
+
+def _comparable_turn(message: Dict, think: bool) -> tuple:
+    content = message.get("content", "")
+    if think:
+        content = strip_reasoning(content)
+    return message.get("role", ""), normalize_text(content)
+
+
+def history_matches(turns: List, conversation: List, think_turns: List) -> bool:
+    """Whether a conversation continues the stored turns of a session.
+
+    Think-mode answers are compared without their reasoning, which clients
+    display but sessions do not store.
+
+    Args:
+        turns: Stored turns of the session
+        conversation: Conversation sent with the request
+        think_turns: Indexes of the turns answered in think mode
+    """
+    if len(conversation) <= len(turns):
+        return False
+    think_indexes = set(think_turns)
+    return all(
+        _comparable_turn(turn, i in think_indexes)
+        == _comparable_turn(message, i in think_indexes)
+        for i, (turn, message) in enumerate(zip(turns, conversation))
+    )
+
+
+def get_session_hits(session: Optional[Dict], keyword: str) -> Optional[List]:
+    """Get the hits of the session's last turn if it searched the same query."""
+    if not session or not session["queries"]:
+        return None
+    if normalize_text(session["queries"][-1]) != normalize_text(keyword):
+        return None
+    metrics.incr("session.hits_reused")
+    return list(session["hits"])
+
+
+async def save_turn(
+    session_id: str,
+    client: str,
+    mode: str,
+    conversation: List,
+    keyword: str,
+    hits: List,
+    answer: str,
+) -> None:
+    """Store a completed turn and refresh the running summary if needed.
+
+    Turns are not stored if the session belongs to another client, or if the
+    conversation does not continue the stored turns.
+    """
+    stored = await _session_store.aget(session_id)
+    if stored is not None and (
+        stored.get("owner") != client
+        or not history_matches(
+            stored["turns"], conversation, stored.get("think_turns", [])
+        )
+    ):
+        metrics.incr("session.turn_rejected")
+        logger.warning(f"Conversation does not continue session {session_id}")
+        return
+
+    session = stored or {
+        "owner": client,
+        "turns": [],
+        "queries": [],
+        "hits": [],
+        "think_turns": [],
+        "summary": "",
+        "summary_key": "",
+        "summary_count": 0,
+    }
+    think_turns = session.get("think_turns", [])
+    if mode == "think":
+        # Only the answer itself is part of the conversation, not the reasoning
+        answer = strip_reasoning(answer)
+        think_turns = think_turns + [len(conversation)]
+    session["think_turns"] = think_turns
+    session["turns"] = list(conversation) + [{"role": "assistant", "content": answer}]
+    session["queries"] = session["queries"] + [keyword]
+    session["hits"] = hits
+    await _session_store.aset(session_id, session)
+
+    needs_summary = len(session["turns"]) > SESSION_RECENT_MESSAGES
+    if needs_summary and session_id not in _summary_tasks:
+        task = asyncio.ensure_future(_update_summary(session_id))
+        _summary_tasks[session_id] = task
+        task.add_done_callback(lambda _: _summary_tasks.pop(session_id, None))
+
+
+async def _update_summary(session_id: str) -> None:
+    try:
+        session = await _session_store.aget(session_id)
+        if session is None:
+            return
+
+        turns = session["turns"]
+        count = len(turns) - SESSION_RECENT_MESSAGES
+        if count <= session["summary_count"]:
+            return
+
+        # Extend the previous summary if it still covers a prefix of the turns
+        summary = session["summary"]
+        start = session["summary_count"]
+        if get_conversation_key(turns[:start]) != session["summary_key"]:
+            summary, start = "", 0
+
+        summary_key = get_conversation_key(turns[:count])
+        summary = await get_llm_full_result(
+            summarize_conversation, summary, turns[start:count]
+        )
+
+        # Write on top of the latest state, turns may have been added meanwhile
+        session = await _session_store.aget(session_id)
+        if session is None:
+            return
+        session["summary"] = summary
+        session["summary_key"] = summary_key
+        session["summary_count"] = count
+        await _session_store.aset(session_id, session)
+        metrics.incr("session.summary_updated")
+    except Exception as e:
+        logger.error(f"Error summarizing session {session_id}: {e}")
+
+
+async def record_turn(
+    session_id: str,
+    client: str,
+    mode: str,
+    conversation: List,
+    keyword: str,
+    hits: List,
+    chat_method,
+    *args,
+    **kwargs,
+):
+    """Wrap the stream of chat_method to store the answer once it completes.
+
+    Aborted answers are not stored.
+    """
+    result_gen = await chat_method(*args, **kwargs)
+
+    async def wrapper():
+        parts = []
+        async for chunk in result_gen:
+            if not isinstance(chunk, SSEEvent):
+                parts.append(chunk)
+            yield chunk
+        answer = "".join(parts)
+        await save_turn(session_id, client, mode, conversation, keyword, hits, answer)
+
+    return wrapper()
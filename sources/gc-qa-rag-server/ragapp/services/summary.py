@@ -1,34 +1,24 @@
 import json
 import logging
-from openai import AsyncOpenAI
-from ragapp.common.config import app_config
+from contextlib import aclosing
+from ragapp.common.llm_client import llm_clients
+from ragapp.common.context import build_hits_context
 
 logger = logging.getLogger(__name__)
 
-client = AsyncOpenAI(
-    api_key=app_config.llm_summary.api_key,
-    base_url=app_config.llm_summary.api_base,
-)
-model_name = app_config.llm_summary.model_name
-
 
 async def chat(messages):
-    completion = await client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-        top_p=0.7,
-        temperature=0.7,
-        stream=True,
-    )
-
-    async for chunk in completion:
-        text = chunk.choices[0].delta.content
-        if text is not None and len(text):
-            yield text
+    stream = llm_clients.get("summary").stream(messages, top_p=0.7, temperature=0.7)
+    # Closing the stream stops the generation if the consumer goes away
+    async with aclosing(stream):
+        async for chunk in stream:
+            text = chunk.choices[0].delta.content
+            if text is not None and len(text):
+                yield text
 
 
 async def summary_hits(keyword, messages, hits, extra_instruction=""):
-    hits_text = json.dumps(hits, ensure_ascii=False, default=vars)
+    hits_text = build_hits_context(hits)
 
     extra_part = ""
     if extra_instruction:
@@ -49,9 +39,33 @@ async def summary_hits(keyword, messages, hits, extra_instruction=""):
         }
     ] + messages
 
-    messages_with_hits[-1]["content"] = hits_prompt
+    messages_with_hits[-1] = {**messages_with_hits[-1], "content": hits_prompt}
     logger.info(
         "summary_hits words: "
         + str(len(json.dumps(messages_with_hits, ensure_ascii=False, default=vars)))
     )
     return chat(messages_with_hits)
+
+
+async def summarize_conversation(summary, messages):
+    contents = "\n".join(
+        f"{message['role']}: {message['content']}" for message in messages
+    )
+    summary_part = ""
+    if summary:
+        summary_part = f"\n## 已有摘要\n{summary}\n"
+
+    prompt = f"""请把下面的对话内容合并到已有摘要中，输出一段简洁的摘要，保留用户关注的产品、问题、关键结论和文档链接，不要输出其他内容。
+{summary_part}
+## 对话内容
+{contents}
+"""
+
+    messages_with_prompt = [
+        {
+            "role": "system",
+            "content": "你是一个乐于解答各种问题的助手。",
+        },
+        {"role": "user", "content": prompt},
+    ]
+    return chat(messages_with_prompt)
@@ -1,46 +1,41 @@
 import json
 import logging
-from openai import AsyncOpenAI
-from ragapp.common.config import app_config
+from contextlib import aclosing
+from ragapp.common.llm_client import llm_clients
+from ragapp.common.context import build_hits_context
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
-client = AsyncOpenAI(
-    api_key=app_config.llm_think.api_key,
-    base_url=app_config.llm_think.api_base,
-)
-model_name = app_config.llm_think.model_name
+# Separates the quoted reasoning from the answer in the think stream
+CONTENT_SEPARATOR = "\r\n---\r\n"
 
 
 async def think(messages):
-    completion = await client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-        stream=True,
-    )
-
     think_started = False
     content_started = False
 
-    async for chunk in completion:
-        reasoning_content = chunk.choices[0].delta.reasoning_content
-        if reasoning_content is not None and len(reasoning_content):
-            if not think_started:
-                yield "> "
-                think_started = True
-            yield reasoning_content.replace("\n", "\n> ")
+    stream = llm_clients.get("think").stream(messages)
+    # Closing the stream stops the generation if the consumer goes away
+    async with aclosing(stream):
+        async for chunk in stream:
+            reasoning_content = chunk.choices[0].delta.reasoning_content
+            if reasoning_content is not None and len(reasoning_content):
+                if not think_started:
+                    yield "> "
+                    think_started = True
+                yield reasoning_content.replace("\n", "\n> ")
 
-        content = chunk.choices[0].delta.content
-        if content is not None and len(content):
-            if not content_started:
-                yield "\r\n---\r\n"
-                content_started = True
-            yield content
+            content = chunk.choices[0].delta.content
+            if content is not None and len(content):
+                if not content_started:
+                    yield CONTENT_SEPARATOR
+                    content_started = True
+                yield content
 
 
 async def summary_hits_think(keyword, messages, hits, extra_instruction=""):
-    hits_text = json.dumps(hits, ensure_ascii=False, default=vars)
+    hits_text = build_hits_context(hits)
 
     extra_part = ""
     if extra_instruction:
@@ -62,7 +57,7 @@ async def summary_hits_think(keyword, messages, hits, extra_instruction=""):
         }
     ] + messages
 
-    messages_with_hits[-1]["content"] = hits_prompt
+    messages_with_hits[-1] = {**messages_with_hits[-1], "content": hits_prompt}
     logger.debug(
         "summary_hits words: "
         + str(len(json.dumps(messages_with_hits, ensure_ascii=False, default=vars)))